@@ -0,0 +1,101 @@
+"""Start-up budget of the capture entry points.
+
+Every job runs in its own process, so import time is paid on every
+capture. For each entry module this measures the cumulative import time
+(``python -X importtime``, best of ``--repeat`` fresh interpreters) and
+checks that the heavy dependencies that are only needed by some job types
+or sources (the kubernetes client, streamlink, opencv, ffmpeg-python) are
+not imported up front::
+
+    python benchmarks/importtime.py             # check against the baseline
+    python benchmarks/importtime.py --update    # record a new baseline
+
+The check fails when a module takes more than ``--tolerance`` times its
+baseline, or when a deferred dependency is imported at start-up.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess as sp
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "importtime_baseline.json")
+
+# loaded on demand: kubernetes for service discovery, streamlink to resolve
+# streaming pages, cv2 for rtsp cameras and resizing, ffmpeg for probing
+DEFERRED = ["kubernetes", "streamlink", "cv2", "ffmpeg"]
+ENTRY_POINTS = ["capture.core.capture", "capture.core.service"]
+
+
+def import_time(module):
+    """Cumulative import time of ``module`` in a fresh interpreter, in ms."""
+    rv = sp.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    pattern = re.compile(rf"import time:\s*\d+ \|\s*(\d+) \| {re.escape(module)}$")
+    for line in rv.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            return int(match.group(1)) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def deferred_imports(module):
+    # the deferred dependencies that importing module loads anyway
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {DEFERRED!r} if m in sys.modules]))"
+    rv = sp.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(rv.stdout)
+
+
+def measure(repeat):
+    return {
+        module: {
+            "import_ms": round(min(import_time(module) for _ in range(repeat)), 1),
+            "deferred_imported": deferred_imports(module),
+        }
+        for module in ENTRY_POINTS
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update", action="store_true", help="write the measurement as the new baseline")
+    args = parser.parse_args()
+
+    results = measure(args.repeat)
+    for module, result in results.items():
+        print(f"{module}: {result['import_ms']} ms, deferred imported: {result['deferred_imported'] or 'none'}")
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    failures = []
+    for module, result in results.items():
+        if result["deferred_imported"]:
+            failures.append(f"{module} imports {', '.join(result['deferred_imported'])} at start-up")
+        budget = baseline.get(module, {}).get("import_ms")
+        if budget and result["import_ms"] > budget * args.tolerance:
+            failures.append(f"{module} took {result['import_ms']} ms, over {args.tolerance}x {budget} ms")
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print("Start-up is within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import shutil
+import threading
+import time
+
+# raw frames in flight per job: reader ring plus recorder ring
+FRAME_BUFFERS = 10
+# x264 keeps about this many frames of lookahead and references
+ENCODER_FRAMES = 20
+# bits per pixel of the h264 we write, to size recordings on disk
+BITS_PER_PIXEL = 0.1
+# pixels per second one core decodes and encodes (1080p at ~30 fps)
+PIXEL_RATE_PER_CORE = 60e6
+# a jpeg takes about this fraction of its raw frame
+JPEG_RATIO = 0.1
+# resident memory of one python worker process (bulk thumbnails)
+PROCESS_MEMORY = 96 * 2**20
+
+
+class Cost:
+    """Memory (bytes), scratch disk (bytes) and cpu (cores) of a job."""
+
+    def __init__(self, memory=0, disk=0, cpu=0):
+        self.memory = memory
+        self.disk = disk
+        self.cpu = cpu
+
+    def __repr__(self):
+        return f"{self.memory / 2**20:.0f} MiB memory, {self.disk / 2**20:.0f} MiB disk, {self.cpu:.2f} cores"
+
+
+def estimate(kind, width, height, fps=30, length=0, mode="transcode", samples=1, shared=False,
+             source_fps=None):
+    """Cost of a job from the size and rates of its source.
+
+    ``fps`` is the rate frames are piped and encoded at; the decoder runs at
+    ``source_fps`` (the same by default), as decimation happens after it.
+    ``shared`` jobs read from a camera session that is already open, so the
+    decoder is not paid for again. A ``watch`` keeps ``length`` seconds of
+    packets and an ``export`` a ring of ``samples`` frames.
+    """
+    frame = width * height * 3
+    source_fps = source_fps or fps
+    decode = 0 if shared else width * height * source_fps / PIXEL_RATE_PER_CORE / 2
+    if kind == "image":
+        return Cost(memory=4 * frame, disk=frame * JPEG_RATIO, cpu=0 if shared else 0.5)
+    if kind == "timelapse":
+        # only samples are piped, the decoder still runs at the source rate
+        return Cost(memory=FRAME_BUFFERS * frame, disk=samples * frame * JPEG_RATIO, cpu=2 * decode)
+    if kind == "export":
+        return Cost(memory=(FRAME_BUFFERS + samples) * frame, cpu=2 * decode)
+    copied = width * height * source_fps * BITS_PER_PIXEL / 8 * length
+    if kind == "watch":
+        # packets are kept in memory instead of written
+        return Cost(memory=32 * 2**20 + copied, cpu=0.05)
+    if mode in ("copy", "segmented"):
+        # packets are copied, nothing is decoded or encoded
+        return Cost(memory=32 * 2**20, disk=copied, cpu=0.05)
+    return Cost(memory=(FRAME_BUFFERS + ENCODER_FRAMES) * frame, disk=copied * fps / source_fps,
+                cpu=decode + width * height * fps / PIXEL_RATE_PER_CORE / 2)
+
+
+def fps_within(cpu, width, height, source_fps, shared=False):
+    """The highest encoding rate (at least 1 fps) a transcode fits in ``cpu``
+    cores, given the decoder keeps running at ``source_fps``."""
+    decode = 0 if shared else width * height * source_fps / PIXEL_RATE_PER_CORE / 2
+    return max(1, int((cpu - decode) * PIXEL_RATE_PER_CORE * 2 / (width * height)))
+
+
+class Budget:
+    """Resources reserved by running jobs, against the limits of the process.
+
+    ``acquire`` waits up to ``timeout`` seconds for running jobs to release
+    enough; a job that alone exceeds a limit should be downgraded or
+    rejected before (see ``fits``). Scratch disk is also checked against
+    what is actually free in ``scratch_dir``.
+    """
+
+    def __init__(self, memory, disk, cpu, scratch_dir):
+        self.memory = memory
+        self.disk = disk
+        self.cpu = cpu
+        self.scratch_dir = scratch_dir
+        self.used = Cost()
+        # jobs holding a reservation; float sums of their costs need not
+        # come back to exactly 0
+        self.running = 0
+        self.cond = threading.Condition()
+
+    def free_disk(self):
+        return shutil.disk_usage(self.scratch_dir).free
+
+    def fits(self, cost):
+        return cost.memory <= self.memory and cost.disk <= self.disk and cost.cpu <= self.cpu
+
+    def _available(self, cost):
+        return (
+            self.used.memory + cost.memory <= self.memory
+            and self.used.disk + cost.disk <= min(self.disk, self.free_disk())
+            # one job always runs, however much cpu it needs
+            and (self.running == 0 or self.used.cpu + cost.cpu <= self.cpu)
+        )
+
+    def acquire(self, cost, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while not self._available(cost):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(min(remaining, 5))
+            self.used.memory += cost.memory
+            self.used.disk += cost.disk
+            self.used.cpu += cost.cpu
+            self.running += 1
+        return True
+
+    def release(self, cost):
+        with self.cond:
+            self.used.memory -= cost.memory
+            self.used.disk -= cost.disk
+            self.used.cpu -= cost.cpu
+            self.running -= 1
+            self.cond.notify_all()
+
+
+def default_budget(scratch_dir):
+    return Budget(
+        memory=float(os.getenv("CAPTURE_MEMORY_BUDGET", 2 * 2**30)),
+        disk=float(os.getenv("CAPTURE_DISK_BUDGET", 20 * 2**30)),
+        cpu=float(os.getenv("CAPTURE_CPU_BUDGET", os.cpu_count() or 1)),
+        scratch_dir=scratch_dir,
+    )
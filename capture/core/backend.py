@@ -0,0 +1,41 @@
+import logging
+import os
+
+import requests
+
+from . import metrics
+
+# one connection pool and one JWT for every job run by this process
+session = requests.Session()
+credentials = {}
+
+
+def login(url, email, password):
+    credentials.update(url=url, email=email, password=password)
+    payload = {"email": email.strip(), "password": password.strip()}
+    logging.info(f"Logging in {url}")
+    with metrics.span("login"):
+        r = session.post(f"{url}/auth/login", json=payload)
+
+    assert "access_token" in r.json()
+    access_token = r.json()["access_token"]
+    os.environ["JWT_KEY"] = f'JWT {access_token}'
+
+
+def relogin():
+    if not credentials:
+        return False
+    login(**credentials)
+    return True
+
+
+def headers():
+    return {"Content-type": "application/json", "X-API-KEY": os.environ.get("JWT_KEY")}
+
+
+def put(url, data, timeout=None):
+    rv = session.put(url, data=data, headers=headers(), timeout=timeout)
+    if rv.status_code == 401 and relogin():
+        logging.info("Token expired. Logged in again")
+        rv = session.put(url, data=data, headers=headers(), timeout=timeout)
+    return rv
@@ -1,31 +1,169 @@
+import hashlib
 import logging
 import re
 import subprocess as sp
-import cv2
 import json
-import numpy as np
 import requests
-import streamlink
 from datetime import datetime
 import tempfile
 import os
-import ffmpeg
-from PIL import Image
-import io
-from .utils import get_service,put, random_string,tempdir,internal_err_resp,message,mkdir
+import signal
+import threading
+import time
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from .utils import move, random_string,tempdir,internal_err_resp,err_resp,message,mkdir,camera_key,fit_size,TTLCache,ffmpeg_path
+from .recorder import VideoRecorder
+from .reader import FrameReader, StallWatchdog
+from .jpeg import write_jpeg
+from .preroll import PrerollWatcher
+from .session import SessionPool
+from .motion import MotionFilter, CHANGE_THRESHOLD
+from .shm import FrameExporter
+from .snapshot_cache import SnapshotCache
+from .admission import Cost, PROCESS_MEMORY, default_budget, estimate, fps_within
+from . import thumbnails
+from .thumbnails import THUMBNAIL_SIZE
+from .postback import get_outbox
+from . import metrics
+
+# extra seconds a recording may take on top of its length before it is cut
+RECORD_GRACE = 10
+# a source that sends no frame for STALL_TIMEOUT seconds (OPEN_TIMEOUT for
+# the first one) is dropped, and recordings reconnect with exponential backoff
+STALL_TIMEOUT = float(os.getenv("STALL_TIMEOUT", 10))
+OPEN_TIMEOUT = float(os.getenv("OPEN_TIMEOUT", 30))
+RECONNECT_BACKOFF = 0.5
+RECONNECT_BACKOFF_MAX = 8
+# monotonic time by which the capture running in this context must be done,
+# set by call_with_timeout; waits for the source are cut short to meet it
+capture_deadline = contextvars.ContextVar("capture_deadline", default=None)
+# seconds call_with_timeout waits past the deadline for the capture to stop
+STOP_GRACE = 5
+
+# every job can do image, video and copy (remux) captures
+CAPABILITIES = frozenset(["image", "video", "copy"])
+# inputs whose reads ffmpeg can time out by itself (-rw_timeout)
+TIMED_SCHEMES = ("http://", "https://", "rtmp://", "tcp://")
+# schemes ffmpeg opens by itself, without streamlink
+DIRECT_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "srt://", "udp://", "tcp://", "file://")
+
+# last stored snapshot of every camera, downscaled, to skip unchanged ones;
+# it is also saved as a small .npy file in SNAPSHOT_REFERENCE_DIR (by default
+# next to the snapshot), so job processes see the one of the previous job
+SNAPSHOT_REFERENCE_TTL = float(os.getenv("SNAPSHOT_REFERENCE_TTL", 3600))
+SNAPSHOT_REFERENCE_DIR = os.getenv("SNAPSHOT_REFERENCE_DIR")
+snapshot_references = TTLCache(SNAPSHOT_REFERENCE_TTL)
+
+# snapshots younger than SNAPSHOT_MAX_AGE seconds are served from the cache
+# (0 disables it, image jobs may pass their own max_age); the cache lives as
+# long as the process, so it only serves jobs in service mode
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", 0))
+snapshot_cache = None
+
+def get_snapshot_cache():
+    global snapshot_cache
+    if snapshot_cache is None:
+        snapshot_cache = SnapshotCache(
+            os.getenv("SNAPSHOT_CACHE_DIR", os.path.join(tempdir(), "capture_snapshots")),
+            int(os.getenv("SNAPSHOT_CACHE_BYTES", 256 * 2**20)),
+        )
+    return snapshot_cache
+
+# jobs are admitted against the memory, disk and cpu budgets of the process
+# (see admission.py); one that does not fit yet waits for running jobs up to
+# ADMISSION_QUEUE_TIMEOUT seconds, and recordings over CAPTURE_MAX_LENGTH
+# seconds are rejected
+budget = default_budget(tempdir())
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 60))
+MAX_LENGTH = float(os.getenv("CAPTURE_MAX_LENGTH", 3600))
+# frame size assumed for the cameras of a batch, which are not probed
+NOMINAL_SIZE = (1920, 1080)
+ADMITTED = ("image", "image_batch", "video", "timelapse", "thumbnails", "watch", "export")
+# jobs priced from their probed source
+PROBED = ("video", "timelapse", "watch", "export")
+# jobs whose stream outlives them hold their reservation until stopped by
+STANDING = ("watch", "export")
+STOPPED_BY = {"unwatch": "watch", "unexport": "export"}
+reservations = {}
+
+# resolved manifest urls, chosen variants and probes, per source url
+resolved = TTLCache(float(os.getenv("SOURCE_CACHE_TTL", 120)))
+
+SOURCES = []
+
+def register_source(matcher, capabilities=CAPABILITIES):
+    """Registers a source class for the urls ``matcher(url)`` accepts.
+
+    Sources are tried in registration order, so specific matchers must be
+    registered before generic ones.
+    """
+    def decorator(source):
+        source.capabilities = frozenset(capabilities)
+        SOURCES.append((matcher, source))
+        return source
+    return decorator
+
+def streaming_source(url, capability=None):
+    for matcher, source in SOURCES:
+        if matcher(url):
+            if capability is not None and capability not in source.capabilities:
+                logging.warning(f"{source.__name__} can not do {capability} captures of {url}")
+                return None
+            return source
+    logging.warning(f"No source found for {url}")
+    return None
+
+def input_options(url):
+    # a network source that stops sending fails the read instead of hanging
+    if url.startswith(TIMED_SCHEMES):
+        return ["-rw_timeout", str(int(STALL_TIMEOUT * 1e6))]
+    return []
+
+def stop_ffmpeg(pipe, timeout):
+    """Waits up to ``timeout`` seconds for ffmpeg to end by itself.
+
+    Copies from a dead or stalled source do not, and nothing reads their
+    output to notice; they are interrupted, so ffmpeg still closes its
+    files, and killed if that does not end them within STOP_GRACE.
+    """
+    try:
+        return pipe.wait(timeout)
+    except sp.TimeoutExpired:
+        logging.warning(f"ffmpeg did not finish in time. Stopping it")
+        pipe.send_signal(signal.SIGINT)
+    try:
+        return pipe.wait(STOP_GRACE)
+    except sp.TimeoutExpired:
+        pipe.kill()
+        return pipe.wait()
+
+def time_left(timeout):
+    # timeout, shortened to what is left before the context's deadline
+    deadline = capture_deadline.get()
+    if deadline is None:
+        return timeout
+    return max(0.1, min(timeout, deadline - time.monotonic()))
+
 
 class StreamingServerSource:
     @staticmethod
-    def create_stream_pipe(url, resolution):
-        if url is None:
-            return None
+    def resolve_stream(url, resolution):
+        key = ("stream", url, tuple(resolution))
+        cached = resolved.get(key)
+        if cached is not None:
+            logging.info(f"Using resolved stream {cached[0]} {cached[1]}")
+            return cached
+        import streamlink
 
         try:
-            streams = streamlink.streams(url)
+            with metrics.span("resolve"):
+                streams = streamlink.streams(url)
         except streamlink.exceptions.NoPluginError:
             logging.warning(f"Warning: NO STREAM AVAILABLE in {url}")
-            return None
-        chosen_res = None
+            return None, None
+        stream_url, chosen_res = None, None
         logging.info(f"streams are found")
         for r in resolution:
             if r in streams and hasattr(streams[r], "url"):
@@ -33,26 +171,47 @@ class StreamingServerSource:
                 chosen_res = r
                 break
         logging.info(f"chosen stream {stream_url} {chosen_res}")
+        if stream_url is not None:
+            resolved.set(key, (stream_url, chosen_res))
+        return stream_url, chosen_res
+
+    @staticmethod
+    def forget(url):
+        # drops everything resolved from url, e.g. once its token expired
+        resolved.evict(lambda key: url in key)
+
+    @staticmethod
+    def create_stream_pipe(url, resolution, pix_fmt="bgr24", fps=None):
+        # (None, None) when no plugin or no variant of resolution was found
+        if url is None:
+            return None, None
+
+        stream_url, _ = StreamingServerSource.resolve_stream(url, resolution)
+        if stream_url is None:
+            return None, None
+        return StreamingServerSource.open_pipe(stream_url, pix_fmt, fps)
 
+    @staticmethod
+    def open_pipe(stream_url, pix_fmt="bgr24", fps=None):
         logging.info(f"Proping stream {stream_url}")
-        p = StreamingServerSource.probe_stream(stream_url)
-        
-        
-        ffmpeg = "/usr/local/bin/ffmpeg"
-        if not os.path.exists(ffmpeg):
-            ffmpeg = "/usr/bin/ffmpeg"
+        p = StreamingServerSource.probe_cached(stream_url)
+
+        # decimating at the decoder means dropped frames are never converted
+        # or piped, and the output rate is constant
+        vf = ["-vf", f"fps={fps}"] if fps else []
         pipe = sp.Popen(
             [
-                ffmpeg,
+                ffmpeg_path(),
                 "-i",
                 stream_url,
                 "-loglevel",
                 "quiet",  # no text output
                 "-an",  # disable audio
+                *vf,
                 "-f",
                 "image2pipe",
                 "-pix_fmt",
-                "bgr24",
+                pix_fmt,  # final pixel format, no conversion in python
                 "-vcodec",
                 "rawvideo",
                 "-",
@@ -62,109 +221,364 @@ class StreamingServerSource:
         )
         return pipe, p
 
+    @staticmethod
+    def remux(stream_url, length, filename):
+        """Copies the source packets straight into a temp mp4 for ``length`` seconds.
+
+        Nothing is decoded, so the cost is the same for any resolution.
+        """
+        if stream_url is None:
+            return False, None, None
+        tempfile = f'{tempdir()}/{datetime.now().strftime("%m_%d_%Y")}_{random_string()}.mp4'
+        logging.info(f"Remuxing {stream_url} for {length} seconds into {tempfile} for {filename}")
+        with metrics.span("remux"):
+            pipe = sp.Popen(
+                [
+                    ffmpeg_path(),
+                    "-loglevel",
+                    "quiet",
+                    *input_options(stream_url),
+                    "-i",
+                    stream_url,
+                    "-t",
+                    str(length),
+                    "-an",  # disable audio
+                    "-c",
+                    "copy",
+                    "-movflags",
+                    "+faststart",
+                    "-y",
+                    tempfile,
+                ],
+                stdin=sp.DEVNULL,
+            )
+            returncode = stop_ffmpeg(pipe, time_left(length + OPEN_TIMEOUT + RECORD_GRACE))
+        if returncode != 0 or not os.path.exists(tempfile):
+            logging.warning(f"Remuxing {stream_url} failed with code {returncode}")
+            return False, tempfile, None
+        thumbnail_frame = StreamingServerSource.keyframe(tempfile)
+        return thumbnail_frame is not None, tempfile, thumbnail_frame
+
+    @staticmethod
+    def snapshot(stream_url, probe, max_size=None):
+        """Decodes one frame and its thumbnail in rgb.
+
+        Both come out of a single decode through a split filter, scaled by
+        ffmpeg, so python never resizes full resolution frames.
+        """
+        width, height = fit_size(probe["width"], probe["height"], max_size)
+        tw, th = fit_size(width, height, THUMBNAIL_SIZE)
+        graph = f"[0:v]split=2[full][small];[small]scale={tw}:{th}[thumb]"
+        if (width, height) != (probe["width"], probe["height"]):
+            graph = f"[0:v]scale={width}:{height},split=2[full][small];[small]scale={tw}:{th}[thumb]"
+        thumb_r, thumb_w = os.pipe()
+        pipe = sp.Popen(
+            [
+                ffmpeg_path(),
+                "-loglevel",
+                "quiet",
+                "-i",
+                stream_url,
+                "-an",
+                "-filter_complex",
+                graph,
+                "-map",
+                "[full]",
+                "-frames:v",
+                "1",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "pipe:1",
+                "-map",
+                "[thumb]",
+                "-frames:v",
+                "1",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                f"pipe:{thumb_w}",
+            ],
+            stdin=sp.DEVNULL,
+            stdout=sp.PIPE,
+            pass_fds=(thumb_w,),
+        )
+        os.close(thumb_w)
+        thumbnail = {}
+        # a source that never sends a frame must not hold the job forever
+        watchdog = StallWatchdog(time_left(OPEN_TIMEOUT), pipe.kill)
+        with os.fdopen(thumb_r, "rb") as thumb_stream:
+            # ffmpeg may write either output first, so both are drained at once
+            thread = threading.Thread(
+                target=lambda: thumbnail.update(
+                    frame=FrameReader(thumb_stream, tw, th, buffer_size=1).read()
+                )
+            )
+            with metrics.span("decode"):
+                thread.start()
+                frame = FrameReader(pipe.stdout, width, height, buffer_size=1).read()
+                thread.join()
+        watchdog.stop()
+        pipe.wait()
+        metrics.count("frames_read", int(frame is not None))
+        return frame, thumbnail.get("frame")
+
+    @staticmethod
+    def keyframe(video_file):
+        # decodes only the first keyframe, in rgb
+        p = StreamingServerSource.probe_stream(video_file)
+        width, height = p["width"], p["height"]
+        pipe = sp.Popen(
+            [
+                ffmpeg_path(),
+                "-loglevel",
+                "quiet",
+                "-skip_frame",
+                "nokey",
+                "-i",
+                video_file,
+                "-an",
+                "-frames:v",
+                "1",
+                "-f",
+                "image2pipe",
+                "-pix_fmt",
+                "rgb24",
+                "-vcodec",
+                "rawvideo",
+                "-",
+            ],
+            stdin=sp.DEVNULL,
+            stdout=sp.PIPE,
+        )
+        frame = FrameReader(pipe.stdout, width, height, buffer_size=1).read()
+        pipe.wait()
+        return frame
+
     @staticmethod
     def probe_stream(stream_url):
-        p = ffmpeg.probe(stream_url, select_streams='v')
+        import ffmpeg
+
+        with metrics.span("probe"):
+            p = ffmpeg.probe(stream_url, select_streams='v')
         return p["streams"][0]
 
     @staticmethod
-    def read(streamer, width, height):
-        raw_image = streamer.stdout.read(height * width * 3)
-        frame = np.fromstring(raw_image, dtype="uint8").reshape((height, width, 3))
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        return frame
+    def probe_cached(stream_url):
+        p = resolved.get(("probe", stream_url))
+        if p is None:
+            p = StreamingServerSource.probe_stream(stream_url)
+            resolved.set(("probe", stream_url), p)
+        return p
 
     @staticmethod
-    def record_video(streamer, width, height, length, filename):
-        # TODO: handle errors
-        count_frame = 0
-        lengthFrames = length * 30  # Assuming 30 frames per second
-        logging.info(f"Starting recording. Will grab {lengthFrames} frames")
-        frames = np.zeros((lengthFrames, height, width, 3), dtype=np.uint8)
-        while count_frame < lengthFrames:
-            raw_image = streamer.stdout.read(height * width * 3)
-            logging.info(f"Frame {count_frame+1}/{lengthFrames}")
-            frames[count_frame] = (
-                np.fromstring(raw_image, dtype="uint8")
-                .reshape((height, width, 3))
-                .astype(np.uint8)
-            )
-            count_frame += 1
-        logging.info(f"Starting writing video. Will write it in {filename}")
-        tempfile =  f'{tempdir()}/{datetime.now().strftime("%m_%d_%Y")}_{random_string()}.mp4'
-        logging.info(f"Creating temp file first {tempfile}")
-        fourcc = cv2.VideoWriter_fourcc(*'H264')
-        writer = cv2.VideoWriter(
-            tempfile,
-            fourcc=fourcc,
-            fps=30,
-            frameSize=(width, height),
-            isColor=True,
-        )
-        logging.info(f"Writing to temp file  {tempfile}")
-        for frame in frames:
-            writer.write(frame)
-        writer.release()
-        # from bgr to rgb
-        thumbnail_frame = frames[0].copy()[:,:,::-1]
-        # freeing memory
-        frames = None
-        return True,tempfile,thumbnail_frame
+    def frame_rate(probe, default=30):
+        # rates are fractions such as "30000/1001"; "0/0" means unknown
+        for key in ("avg_frame_rate", "r_frame_rate"):
+            num, _, den = probe.get(key, "0/0").partition("/")
+            try:
+                rate = float(num) / float(den or 1)
+            except (ValueError, ZeroDivisionError):
+                continue
+            if 0 < rate <= 240:
+                return rate
+        return default
+
+    @staticmethod
+    def reopener(source, url, width, height, fps):
+        # opens url again with fresh tokens, at the size and rate of the recording
+        def reopen():
+            StreamingServerSource.forget(url)
+            streamer, new_width, new_height, _ = source.open(url, fps=fps)
+            if streamer is None:
+                return None
+            if (new_width, new_height) != (width, height):
+                streamer.kill()
+                raise ValueError(f"stream came back as {new_width}X{new_height} instead of {width}X{height}")
+            return streamer
+        return reopen
+
+    @staticmethod
+    def reconnect(reopen, deadline):
+        """Calls ``reopen`` with exponential backoff until it succeeds or
+        ``deadline`` passes, and returns what it returned (or None)."""
+        delay = RECONNECT_BACKOFF
+        while time.monotonic() + delay < deadline:
+            time.sleep(delay)
+            try:
+                streamer = reopen()
+            except Exception as e:
+                logging.warning(f"Reconnecting failed: {e}")
+            else:
+                if streamer is not None:
+                    logging.info("Reconnected")
+                    metrics.count("reconnects")
+                    return streamer
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+        return None
 
+    @staticmethod
+    def record_video(streamer, width, height, length, filename, fps=30, motion=None, reopen=None, gaps=None):
+        """Records ``length`` seconds of a pipe and kills it when done.
+
+        A pipe that ends or stalls (no frame for STALL_TIMEOUT seconds) is
+        reopened with ``reopen`` while the deadline allows. The clip then
+        continues after the gap, and ``gaps`` gets where it happened (in
+        seconds of the clip) and how long the source was away.
+        """
+        # the pipe has a constant rate of fps, so the frame count is the
+        # media duration; the wall-clock deadline guards slow sources
+        lengthFrames = round(length * fps)
+        deadline = time.monotonic() + length + max(RECORD_GRACE, length)
+        logging.info(f"Starting recording. Will grab {lengthFrames} frames at {fps} fps for {filename}")
+        recorder = VideoRecorder(width, height, fps=fps, ffmpeg=ffmpeg_path())
+        reader = FrameReader(streamer.stdout, width, height)
+        watchdog = StallWatchdog(STALL_TIMEOUT, streamer.kill, OPEN_TIMEOUT)
+        opened = time.perf_counter()
+        read_time = 0
+        # frames read over every connection
+        frames = 0
+        while frames < lengthFrames:
+            slot = recorder.slot()
+            start = time.perf_counter()
+            frame = reader.read(slot)
+            read_time += time.perf_counter() - start
+            if frame is None:
+                watchdog.stop()
+                streamer.kill()
+                reason = "stalled" if watchdog.stalled else "ended"
+                logging.warning(f"Stream {reason} after {frames}/{lengthFrames} frames")
+                if reopen is None:
+                    break
+                lost = time.monotonic()
+                streamer = StreamingServerSource.reconnect(reopen, deadline)
+                if streamer is None:
+                    break
+                if gaps is not None:
+                    gaps.append({"at": round(frames / fps, 3), "duration": round(time.monotonic() - lost, 3)})
+                reader = FrameReader(streamer.stdout, width, height)
+                watchdog = StallWatchdog(STALL_TIMEOUT, streamer.kill, OPEN_TIMEOUT)
+                continue
+            watchdog.feed()
+            frames += 1
+            if frames == 1:
+                metrics.add("first_frame", time.perf_counter() - opened)
+            # an idle frame is not written, and its slot is read into again
+            if motion is None or motion.observe(frame, (frames - 1) / fps):
+                recorder.write(frame)
+            if time.monotonic() > deadline:
+                logging.warning(f"Source is too slow. Stopping after {frames}/{lengthFrames} frames")
+                break
+        watchdog.stop()
+        if streamer is not None:
+            streamer.kill()
+        if motion is not None:
+            motion.close(frames / fps)
+        # the encoder finishes the frames still queued
+        start = time.perf_counter()
+        result = recorder.release()
+        metrics.add("encode_drain", time.perf_counter() - start)
+        metrics.add("read", read_time)
+        metrics.add("encode_wait", recorder.stalled)
+        metrics.count("frames_read", frames)
+        metrics.count("frames_dropped", frames - recorder.count)
+        return result
+
+@register_source(lambda url: "angelcam" in url)
 class AngelCamSource(StreamingServerSource):
     resolutions = {"best": {"width": 1920, "height": 1080}}
 
     @staticmethod
-    def open(url):
-        c = requests.get(url).content.decode("utf-8")
-        m3u8 = re.findall(r"\'https://.*angelcam.*token=.*\'", c)[0].strip("'")
-        streamer, chosen_res = StreamingServerSource.create_stream_pipe(m3u8, ["best"])
-        res = AngelCamSource.resolutions[chosen_res]
-        width, height = res["width"], res["height"]
-        return streamer, width, height
+    def scrape(url):
+        m3u8 = resolved.get(("scrape", url))
+        if m3u8 is None:
+            with metrics.span("scrape"):
+                c = requests.get(url).content.decode("utf-8")
+            m3u8 = re.findall(r"\'https://.*angelcam.*token=.*\'", c)[0].strip("'")
+            resolved.set(("scrape", url), m3u8)
+        return m3u8
 
     @staticmethod
-    def capture_image(url):
-        streamer, width, height = AngelCamSource.open(url)
-        frame = StreamingServerSource.read(streamer, width, height)
-        streamer.kill()
-        return frame
+    def open(url, pix_fmt="bgr24", fps=None):
+        m3u8 = AngelCamSource.scrape(url)
+        streamer, probe = StreamingServerSource.create_stream_pipe(m3u8, ["best"], pix_fmt, fps)
+        if streamer is None:
+            return None, None, None, None
+        width, height = probe["width"],probe["height"]
+        fps = fps or StreamingServerSource.frame_rate(probe)
+        return streamer, width, height, fps
 
     @staticmethod
-    def record_video(url, length, filename):
-        streamer, width, height = AngelCamSource.open(url)
-        succeeded,tmp_path,thumbnail_frame = StreamingServerSource.record_video(
-            streamer, width, height, length, filename
+    def capture_image(url, max_size=None):
+        stream_url, _ = StreamingServerSource.resolve_stream(AngelCamSource.scrape(url), ["best"])
+        if stream_url is None:
+            return None, None
+        probe = StreamingServerSource.probe_cached(stream_url)
+        return StreamingServerSource.snapshot(stream_url, probe, max_size)
+
+    @staticmethod
+    def record_video(url, length, filename, fps=None, motion=None, gaps=None):
+        streamer, width, height, fps = AngelCamSource.open(url, fps=fps)
+        if streamer is None:
+            return False, None, None
+        return StreamingServerSource.record_video(
+            streamer, width, height, length, filename, fps, motion,
+            StreamingServerSource.reopener(AngelCamSource, url, width, height, fps), gaps,
         )
-        streamer.kill()
-        return succeeded,tmp_path,thumbnail_frame
 
+    @staticmethod
+    def stream_url(url):
+        stream_url, _ = StreamingServerSource.resolve_stream(AngelCamSource.scrape(url), ["best"])
+        return stream_url
+
+    @staticmethod
+    def remux_video(url, length, filename):
+        return StreamingServerSource.remux(AngelCamSource.stream_url(url), length, filename)
+
+@register_source(lambda url: url.endswith(".m3u8"))
 class M3U8Source(StreamingServerSource):
     resolutions = {"best": {"width": 320, "height": 180}}
     @staticmethod
-    def open(url):
+    def open(url, pix_fmt="bgr24", fps=None):
         m3u8 = url
-        streamer, probe = StreamingServerSource.create_stream_pipe(m3u8, ["best"])
+        streamer, probe = StreamingServerSource.create_stream_pipe(m3u8, ["best"], pix_fmt, fps)
+        if streamer is None:
+            return None, None, None, None
         width, height = probe["width"],probe["height"]
-        logging.info(f"Stream opened with resolution: {width}X{height}")
-        return streamer, width, height
+        fps = fps or StreamingServerSource.frame_rate(probe)
+        logging.info(f"Stream opened with resolution: {width}X{height} at {fps} fps")
+        return streamer, width, height, fps
 
     @staticmethod
-    def capture_image(url):
-        streamer, width, height = M3U8Source.open(url)
-        frame = StreamingServerSource.read(streamer, width, height)
-        streamer.kill()
-        return frame
+    def capture_image(url, max_size=None):
+        stream_url, _ = StreamingServerSource.resolve_stream(url, ["best"])
+        if stream_url is None:
+            return None, None
+        probe = StreamingServerSource.probe_cached(stream_url)
+        return StreamingServerSource.snapshot(stream_url, probe, max_size)
 
     @staticmethod
-    def record_video(url, length, filename):
-        streamer, width, height = M3U8Source.open(url)
-        succeeded,tmp_path,thumbnail_frame = StreamingServerSource.record_video(
-            streamer, width, height, length, filename
+    def record_video(url, length, filename, fps=None, motion=None, gaps=None):
+        streamer, width, height, fps = M3U8Source.open(url, fps=fps)
+        if streamer is None:
+            return False, None, None
+        return StreamingServerSource.record_video(
+            streamer, width, height, length, filename, fps, motion,
+            StreamingServerSource.reopener(M3U8Source, url, width, height, fps), gaps,
         )
-        streamer.kill()
-        return succeeded,tmp_path,thumbnail_frame
 
+    @staticmethod
+    def stream_url(url):
+        stream_url, _ = StreamingServerSource.resolve_stream(url, ["best"])
+        return stream_url
+
+    @staticmethod
+    def remux_video(url, length, filename):
+        return StreamingServerSource.remux(M3U8Source.stream_url(url), length, filename)
+
+@register_source(lambda url: "youtube" in url)
 class YoutubeSource(StreamingServerSource):
     resolutions = {
         "240p": {"width": 426, "height": 240},
@@ -175,133 +589,396 @@ class YoutubeSource(StreamingServerSource):
     }
 
     @staticmethod
-    def open(url):
+    def open(url, pix_fmt="bgr24", fps=None):
         logging.info(f"Opening streamer {url}")
         streamer, probe = StreamingServerSource.create_stream_pipe(
-            url, ["1080p", "720p", "480p", "360p", "240p"]
+            url, ["1080p", "720p", "480p", "360p", "240p"], pix_fmt, fps
         )
+        if streamer is None:
+            return None, None, None, None
         #logging.info(f"Chosen resolution {chosen_res}")
         # res = YoutubeSource.resolutions[chosen_res]
         # width, height = res["width"], res["height"]
         width, height = probe["width"],probe["height"]
-        logging.info(f"Stream opened with resolution: {width}X{height}")
-        return streamer, width, height
+        fps = fps or StreamingServerSource.frame_rate(probe)
+        logging.info(f"Stream opened with resolution: {width}X{height} at {fps} fps")
+        return streamer, width, height, fps
 
     @staticmethod
-    def capture_image(url):
+    def capture_image(url, max_size=None):
         logging.info(f"Capturing image from youtube source {url}")
-        streamer, width, height = YoutubeSource.open(url)
-        logging.info(f"Streamer opened width: {width} height: {height}")
-        frame = StreamingServerSource.read(streamer, width, height)
-        logging.info("Capturing finished. Killing streamer")
-        streamer.kill()
-        return frame
+        stream_url, _ = StreamingServerSource.resolve_stream(
+            url, ["1080p", "720p", "480p", "360p", "240p"]
+        )
+        if stream_url is None:
+            return None, None
+        probe = StreamingServerSource.probe_cached(stream_url)
+        logging.info(f"Stream found width: {probe['width']} height: {probe['height']}")
+        return StreamingServerSource.snapshot(stream_url, probe, max_size)
 
     @staticmethod
-    def record_video(url, length, filename):
-        streamer, width, height = YoutubeSource.open(url)
+    def record_video(url, length, filename, fps=None, motion=None, gaps=None):
+        streamer, width, height, fps = YoutubeSource.open(url, fps=fps)
+        if streamer is None:
+            return False, None, None
         logging.info(f"Streamer opened with width={width} height={height}")
-        succeeded, tmp_path, thumbnail_frame = StreamingServerSource.record_video(
-            streamer, width, height, length, filename
+        return StreamingServerSource.record_video(
+            streamer, width, height, length, filename, fps, motion,
+            StreamingServerSource.reopener(YoutubeSource, url, width, height, fps), gaps,
         )
-        logging.info("Recording finished. Killing streamer")
-        streamer.kill()
-        return succeeded,tmp_path,thumbnail_frame
+
+    @staticmethod
+    def stream_url(url):
+        stream_url, _ = StreamingServerSource.resolve_stream(
+            url, ["1080p", "720p", "480p", "360p", "240p"]
+        )
+        return stream_url
+
+    @staticmethod
+    def remux_video(url, length, filename):
+        return StreamingServerSource.remux(YoutubeSource.stream_url(url), length, filename)
+
+@register_source(lambda url: url.startswith(DIRECT_SCHEMES) or os.path.isfile(url))
+class DirectSource(StreamingServerSource):
+    """Inputs ffmpeg opens by itself: rtsp/rtmp/srt/udp/tcp urls and local files."""
+
+    @staticmethod
+    def stream_url(url):
+        return url
+
+    @staticmethod
+    def open(url, pix_fmt="bgr24", fps=None):
+        streamer, probe = StreamingServerSource.open_pipe(url, pix_fmt, fps)
+        width, height = probe["width"],probe["height"]
+        fps = fps or StreamingServerSource.frame_rate(probe)
+        logging.info(f"Stream opened with resolution: {width}X{height} at {fps} fps")
+        return streamer, width, height, fps
+
+    @staticmethod
+    def capture_image(url, max_size=None):
+        probe = StreamingServerSource.probe_cached(url)
+        return StreamingServerSource.snapshot(url, probe, max_size)
+
+    @staticmethod
+    def record_video(url, length, filename, fps=None, motion=None, gaps=None):
+        streamer, width, height, fps = DirectSource.open(url, fps=fps)
+        return StreamingServerSource.record_video(
+            streamer, width, height, length, filename, fps, motion,
+            StreamingServerSource.reopener(DirectSource, url, width, height, fps), gaps,
+        )
+
+    @staticmethod
+    def remux_video(url, length, filename):
+        return StreamingServerSource.remux(url, length, filename)
 
 class RTSPSource:
     @staticmethod
-    def open(ipv4, port, username, password):
+    def url(ipv4, port, username, password):
         url = "rtsp://"
         if username != "":
             url += f"{username}:{password}@"
         url += f"{ipv4}:{port}/Streaming/Channels/1"
-        streamer = cv2.VideoCapture(url)
-        return streamer
+        return url
+
+    @staticmethod
+    def open(ipv4, port, username, password):
+        import cv2
+
+        url = RTSPSource.url(ipv4, port, username, password)
+        if hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"):
+            # opencv >= 4.5.2: a dead camera fails the read instead of blocking it
+            return cv2.VideoCapture(url, cv2.CAP_FFMPEG, [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(time_left(OPEN_TIMEOUT) * 1000),
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(time_left(STALL_TIMEOUT) * 1000),
+            ])
+        return cv2.VideoCapture(url)
 
     @staticmethod
-    def capture_image(ipv4, port, username, password):
+    def reopener(ipv4, port, username, password, width, height):
+        import cv2
+
+        def reopen():
+            streamer = RTSPSource.open(ipv4, port, username, password)
+            size = (int(streamer.get(cv2.CAP_PROP_FRAME_WIDTH)), int(streamer.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            if not streamer.isOpened() or size != (width, height):
+                streamer.release()
+                raise ValueError(f"camera did not come back at {width}X{height}")
+            return streamer
+        return reopen
+
+    @staticmethod
+    def capture_image(ipv4, port, username, password, max_size=None):
+        import cv2
+
         streamer = RTSPSource.open(ipv4, port, username, password)
         ret, frame = streamer.read()
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         streamer.release()
-        return frame
+        if not ret:
+            return None, None
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return resize(frame, max_size), thumbnail_of(frame)
 
     @staticmethod
-    def record_video(ipv4, port, username, password, length, filename):
+    def record_video(ipv4, port, username, password, length, filename, fps=None, motion=None, gaps=None):
+        import cv2
+
         streamer = RTSPSource.open(ipv4, port, username, password)
         width = int(streamer.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(streamer.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        source_fps = streamer.get(cv2.CAP_PROP_FPS)
+        if not 0 < source_fps <= 240:
+            source_fps = 30
+        fps = min(fps or source_fps, source_fps)
 
-        count_frame = 0
-        lengthFrames = length * 30  # Assuming 30 frames per second
-        frames = np.zeros((lengthFrames, height, width, 3),dtype=np.uint8)
-
-        while count_frame < lengthFrames:
-            ret, frame = streamer.read()
+        # duration and decimation follow the frame timestamps; after a
+        # reconnect, the clip goes on where the last connection stopped
+        logging.info(f"Starting recording. Will record {length} seconds at {fps} fps for {filename}")
+        recorder = VideoRecorder(width, height, fps=fps, ffmpeg=ffmpeg_path())
+        reopen = RTSPSource.reopener(ipv4, port, username, password, width, height)
+        deadline = time.monotonic() + length + max(RECORD_GRACE, length)
+        start = None
+        offset = elapsed = 0
+        opened = time.perf_counter()
+        read_time = 0
+        # frames on the fps grid, whether idle or not
+        sampled = grabbed = dropped = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            if not streamer.grab():
+                streamer.release()
+                logging.warning(f"Camera dropped after {elapsed:.1f}/{length} seconds")
+                lost = time.monotonic()
+                streamer = StreamingServerSource.reconnect(reopen, deadline)
+                if streamer is None:
+                    break
+                if gaps is not None:
+                    gaps.append({"at": round(elapsed, 3), "duration": round(time.monotonic() - lost, 3)})
+                offset, start = elapsed, None
+                continue
+            grabbed += 1
+            read_time += time.perf_counter() - started
+            pts = streamer.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if start is None:
+                start = pts
+                if grabbed == 1:
+                    metrics.add("first_frame", time.perf_counter() - opened)
+            elapsed = offset + pts - start
+            if elapsed >= length:
+                break
+            if elapsed < sampled / fps - 0.5 / source_fps:
+                # decimated: decoded, but never converted or encoded
+                dropped += 1
+                continue
+            # the encoder expects bgr, so frames are kept as decoded
+            slot = recorder.slot()
+            started = time.perf_counter()
+            ret, frame = streamer.retrieve(slot)
+            read_time += time.perf_counter() - started
             if not ret:
                 break
-            frames[count_frame] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB).astype(np.uint8)
-            count_frame += 1
+            sampled += 1
+            if motion is None or motion.observe(frame, elapsed):
+                recorder.write(frame)
+            else:
+                dropped += 1
+        if streamer is not None:
+            streamer.release()
+        if motion is not None:
+            motion.close(sampled / fps)
 
-        streamer.release()
-        logging.info(f"Starting writing video. Will write it in {filename}")
-        tempfile =  f'{tempdir()}/{datetime.now().strftime("%m_%d_%Y")}_{random_string()}.mp4'
-        logging.info(f"Creating temp file first {tempfile}")
-        fourcc = cv2.VideoWriter_fourcc(*'H264')
-        writer = cv2.VideoWriter(
-            tempfile,
-            fourcc=fourcc,
-            fps=30,
-            frameSize=(width, height),
-            isColor=True,
-        )
-        logging.info(f"Writing to temp file  {tempfile}")
-        for frame in frames:
-            writer.write(frame)
-        writer.release()
-        # from bgr to rgb
-        thumbnail_frame = frames[0].copy()[:,:,::-1]
-        # freeing memory
-        frames = None
-        return True, tempfile,thumbnail_frame
-
-def capture_image_from_streaming_server(url):
-    if "youtube" in url:
-        logging.info(f"Recording from youtube source {url}")
-        return YoutubeSource.capture_image(url)
-    elif "angelcam" in url:
-        return AngelCamSource.capture_image(url)
-    elif url.endswith(".m3u8"):
-        return M3U8Source.capture_image(url)
-
-def capture_image_from_rtsp(host, port, username, password):
-    return RTSPSource.capture_image(host, port, username, password)
-
-def capture_image(camera):
+        started = time.perf_counter()
+        result = recorder.release()
+        metrics.add("encode_drain", time.perf_counter() - started)
+        metrics.add("read", read_time)
+        metrics.add("encode_wait", recorder.stalled)
+        metrics.count("frames_read", grabbed)
+        metrics.count("frames_dropped", dropped)
+        return result
+
+    @staticmethod
+    def remux_video(ipv4, port, username, password, length, filename):
+        url = RTSPSource.url(ipv4, port, username, password)
+        return StreamingServerSource.remux(url, length, filename)
+
+def open_stream(camera):
+    # returns a (read, close) pair for the session pool; read yields rgb frames
+    if "url" in camera:
+        source = streaming_source(camera["url"], "image")
+        if source is None:
+            raise ValueError(f"No source found for {camera['url']}")
+        streamer, width, height, _ = source.open(camera["url"], "rgb24")
+        if streamer is None:
+            raise ValueError(f"No stream found for {camera['url']}")
+        reader = FrameReader(streamer.stdout, width, height)
+
+        def read():
+            return reader.read()
+
+        return read, streamer.kill
+
+    streamer = RTSPSource.open(
+        camera["host"], camera["port"], camera["username"], camera["password"]
+    )
+
+    import cv2
+
+    def read():
+        ret, frame = streamer.read()
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if ret else None
+
+    return read, streamer.release
+
+sessions = SessionPool(
+    open_stream,
+    max_sessions=int(os.getenv("CAPTURE_MAX_SESSIONS", 0)),
+    idle_timeout=float(os.getenv("CAPTURE_SESSION_IDLE_TIMEOUT", 60)),
+)
+
+# cameras whose live frames are published to shared memory for local consumers
+exporter = FrameExporter(open_stream)
+
+def resize(frame, max_size):
+    width, height = fit_size(frame.shape[1], frame.shape[0], max_size)
+    if (width, height) == (frame.shape[1], frame.shape[0]):
+        return frame
+    import cv2
+
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+def thumbnail_of(frame):
+    return resize(frame, THUMBNAIL_SIZE)
+
+def capture_image_from_streaming_server(url, max_size=None):
+    source = streaming_source(url, "image")
+    if source is None:
+        return None, None
+    logging.info(f"Capturing from {source.__name__} {url}")
+    return source.capture_image(url, max_size)
+
+def capture_image_from_rtsp(host, port, username, password, max_size=None):
+    return RTSPSource.capture_image(host, port, username, password, max_size)
+
+def capture_image(camera, max_size=None):
+    """Returns an (image, thumbnail) pair of rgb frames, (None, None) on failure."""
+    if sessions.enabled:
+        frame = sessions.capture(camera, time_left(10))
+        if frame is None:
+            return None, None
+        return resize(frame, max_size), thumbnail_of(frame)
     if "url" in camera:
         logging.info(f"Recording from streaming server {camera['url']}")
-        return capture_image_from_streaming_server(camera["url"])
+        return capture_image_from_streaming_server(camera["url"], max_size)
     else:
         return capture_image_from_rtsp(
-            camera["host"], camera["port"], camera["username"], camera["password"]
+            camera["host"], camera["port"], camera["username"], camera["password"], max_size
         )
 
-def record_video_from_streaming_server(url, length, outputpath):
-    if "youtube" in url:
-        logging.info("Recording from youtube server")
-        return YoutubeSource.record_video(url, length, outputpath)
-    elif "angelcam" in url:
-        return AngelCamSource.record_video(url, length, outputpath)
-    elif url.endswith(".m3u8"):
-        return M3U8Source.record_video(url, length, outputpath)
+def record_video_from_streaming_server(url, length, outputpath, fps=None, motion=None, gaps=None):
+    source = streaming_source(url, "video")
+    if source is None:
+        return False, None, None
+    logging.info(f"Recording from {source.__name__} {url}")
+    return source.record_video(url, length, outputpath, fps, motion, gaps)
+
+def record_video_from_rtsp(host, port, username, password, length, outputpath, fps=None, motion=None, gaps=None):
+    return RTSPSource.record_video(host, port, username, password, length, outputpath, fps, motion, gaps)
+
+def stream_frame_rate(camera, default=30):
+    try:
+        return StreamingServerSource.frame_rate(
+            StreamingServerSource.probe_cached(camera_stream_url(camera)), default
+        )
+    except Exception as e:
+        logging.warning(f"Probing {camera_key(camera)} failed: {e}. Assuming {default} fps")
+        return default
 
-def record_video_from_rtsp(host, port, username, password, length, outputpath):
-    return RTSPSource.record_video(host, port, username, password, length, outputpath)
+def open_session(camera, shape=None):
+    # the camera's session once it has a frame (of the given shape), or None
+    session = sessions.get(camera)
+    frame = session.latest(OPEN_TIMEOUT)
+    if frame is None:
+        sessions.discard(session.key)
+        return None
+    if shape is not None and frame.shape != shape:
+        raise ValueError(f"stream came back as {frame.shape[1]}X{frame.shape[0]} instead of {shape[1]}X{shape[0]}")
+    return session
 
-def record_video(camera, length, outputpath):
+def record_video_from_session(camera, length, outputpath, fps=None, motion=None, gaps=None):
+    """Records from the camera's session, so concurrent jobs share one upstream.
+
+    The session is sampled on a wall-clock grid of ``fps``: frames faster
+    than that are skipped and a late frame is repeated for the ticks it
+    missed. A session that ends or stalls is reopened while the deadline
+    allows, and the clip continues after the gap.
+    """
+    fps = fps or stream_frame_rate(camera)
+    lengthFrames = round(length * fps)
+    deadline = time.monotonic() + length + max(RECORD_GRACE, length)
+    opened = time.perf_counter()
+    session = open_session(camera)
+    if session is None:
+        logging.warning(f"No frame received from {camera_key(camera)} in {OPEN_TIMEOUT} seconds")
+        return False, None, None
+    metrics.add("first_frame", time.perf_counter() - opened)
+    shape = session.frame.shape
+    logging.info(f"Starting recording from session {session.key}. Will take {lengthFrames} frames at {fps} fps")
+    recorder = VideoRecorder(shape[1], shape[0], fps=fps, ffmpeg=ffmpeg_path(), pix_fmt="rgb24")
+    start = time.monotonic()
+    read_time = 0
+    seq = 0
+    # frames taken from the session, and ticks of the grid filled so far
+    taken = 0
+    frames = 0
+    while frames < lengthFrames and time.monotonic() < deadline:
+        slot = recorder.slot()
+        t = time.perf_counter()
+        latest = session.latest_into(slot, seq, STALL_TIMEOUT)
+        read_time += time.perf_counter() - t
+        if latest is None:
+            reason = "stalled" if session.alive else "ended"
+            logging.warning(f"Session {reason} after {frames}/{lengthFrames} frames")
+            sessions.discard(session.key)
+            lost = time.monotonic()
+            session = StreamingServerSource.reconnect(lambda: open_session(camera, shape), deadline)
+            if session is None:
+                break
+            if gaps is not None:
+                gaps.append({"at": round(frames / fps, 3), "duration": round(time.monotonic() - lost, 3)})
+            # the grid resumes after the gap instead of filling it
+            start += time.monotonic() - lost
+            seq = 0
+            continue
+        seq = latest
+        ticks = min(int((time.monotonic() - start) * fps) + 1, lengthFrames) - frames
+        if ticks <= 0:
+            # faster than fps; the slot is read into again
+            continue
+        taken += 1
+        if motion is None or motion.observe(slot, frames / fps):
+            repeated = slot.copy() if ticks > 1 else None
+            recorder.write(slot)
+            for _ in range(ticks - 1):
+                recorder.write(repeated)
+        frames += ticks
+    if motion is not None:
+        motion.close(frames / fps)
+    start = time.perf_counter()
+    result = recorder.release()
+    metrics.add("encode_drain", time.perf_counter() - start)
+    metrics.add("read", read_time)
+    metrics.add("encode_wait", recorder.stalled)
+    metrics.count("frames_read", taken)
+    metrics.count("frames_dropped", frames - recorder.count)
+    return result
+
+def record_video(camera, length, outputpath, fps=None, motion=None, gaps=None):
+    # motion, a MotionFilter, drops the frames of idle stretches it finds;
+    # gaps, a list, gets the stretches the source was away
+    if sessions.enabled:
+        return record_video_from_session(camera, length, outputpath, fps, motion, gaps)
     if "url" in camera:
         logging.info(f"Recording from streaming server {camera['url']}")
-        return record_video_from_streaming_server(camera["url"], length, outputpath)
+        return record_video_from_streaming_server(camera["url"], length, outputpath, fps, motion, gaps)
     else:
         return record_video_from_rtsp(
             camera["host"],
@@ -310,140 +987,771 @@ def record_video(camera, length, outputpath):
             camera["password"],
             length,
             outputpath,
+            fps,
+            motion,
+            gaps,
         )
 
-def generate_thumbnail(url):
-    streamer = cv2.VideoCapture(url)
-    ret, frame = streamer.read()
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    streamer.release()
-    return frame
+def remux_video_from_streaming_server(url, length, outputpath):
+    source = streaming_source(url, "copy")
+    if source is None:
+        return False, None, None
+    logging.info(f"Remuxing from {source.__name__} {url}")
+    return source.remux_video(url, length, outputpath)
 
-def post_back(registry_key,capture_status):
-    try:
-        backend_server = get_service("falcoeye-backend")
-        postback_url = f"{backend_server}/api/capture/{registry_key}"
-        resp = message(True, "capture completed")
-        resp["capture_status"] = capture_status
-        logging.info(f"Posting new status {capture_status} to backend {postback_url}")
-        rv = requests.put(
-            postback_url,
-            data=json.dumps(resp),
-            headers={"Content-type": "application/json","X-API-KEY":os.environ.get("JWT_KEY")},
+def remux_video_from_rtsp(host, port, username, password, length, outputpath):
+    return RTSPSource.remux_video(host, port, username, password, length, outputpath)
+
+def remux_video(camera, length, outputpath):
+    if "url" in camera:
+        logging.info(f"Remuxing from streaming server {camera['url']}")
+        return remux_video_from_streaming_server(camera["url"], length, outputpath)
+    else:
+        return remux_video_from_rtsp(
+            camera["host"],
+            camera["port"],
+            camera["username"],
+            camera["password"],
+            length,
+            outputpath,
         )
-        if rv.headers["content-type"].strip().startswith("application/json"):
-            logging.info(f"Response received {rv.json()}")
+
+def camera_stream_url(camera):
+    if "url" in camera:
+        source = streaming_source(camera["url"], "copy")
+        return None if source is None else source.stream_url(camera["url"])
+    return RTSPSource.url(camera["host"], camera["port"], camera["username"], camera["password"])
+
+watcher = PrerollWatcher(STALL_TIMEOUT, OPEN_TIMEOUT)
+
+def record_preroll(buffer, preroll, length, outputpath):
+    ts_path = buffer.record(preroll, length, outputpath)
+    if ts_path is None:
+        return False, None, None
+    # the ts only has to be rewrapped, nothing is decoded
+    recorded = StreamingServerSource.remux(ts_path, preroll + length, outputpath)
+    os.remove(ts_path)
+    return recorded
+
+def record_segmented(camera, length, outputpath, segment_length=10):
+    """Records ``length`` seconds as a series of ``segment_length`` mp4 files.
+
+    Each segment is moved next to ``outputpath`` (``<name>_00000.mp4``, ...)
+    as soon as ffmpeg closes it, so consumers can start on the recording
+    while it runs and scratch disk use stays at about one segment.
+    Returns (succeeded, segment paths, thumbnail_frame).
+    """
+    stream_url = camera_stream_url(camera)
+    if stream_url is None:
+        return False, [], None
+    base = os.path.splitext(os.path.basename(outputpath))[0]
+    fdir = os.path.dirname(outputpath)
+    mkdir(fdir)
+    scratch = tempfile.mkdtemp(dir=tempdir())
+    logging.info(f"Recording {stream_url} in {segment_length}s segments through {scratch}")
+    pipe = sp.Popen(
+        [
+            ffmpeg_path(),
+            "-loglevel",
+            "quiet",
+            *input_options(stream_url),
+            "-i",
+            stream_url,
+            "-t",
+            str(length),
+            "-an",
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_time",
+            str(segment_length),
+            "-segment_format",
+            "mp4",
+            "-segment_format_options",
+            "movflags=+faststart",
+            "-reset_timestamps",
+            "1",
+            os.path.join(scratch, f"{base}_%05d.mp4"),
+        ],
+        stdin=sp.DEVNULL,
+    )
+    segments = []
+
+    def publish(closed):
+        for name in closed:
+            destination = os.path.join(fdir, name)
+            move(os.path.join(scratch, name), destination)
+            segments.append(destination)
+
+    deadline = time.monotonic() + length + OPEN_TIMEOUT + RECORD_GRACE
+    while pipe.poll() is None and time.monotonic() < deadline:
+        # every segment but the one being written is complete
+        publish(sorted(os.listdir(scratch))[:-1])
+        time.sleep(0.5)
+    stop_ffmpeg(pipe, 0)
+    publish(sorted(os.listdir(scratch)))
+    os.rmdir(scratch)
+    if pipe.returncode != 0 or not segments:
+        logging.warning(f"Segmented recording of {stream_url} ended with code {pipe.returncode}")
+    if not segments:
+        return False, [], None
+    return True, segments, StreamingServerSource.keyframe(segments[0])
+
+def record_timelapse(camera, duration, interval, outputpath, mode="images", playback_fps=25,
+                     jpeg_options=None, progress=None, gaps=None):
+    """Samples a frame every ``interval`` seconds for ``duration`` seconds.
+
+    The stream is opened once and ffmpeg's fps filter drops the frames in
+    between, so only the samples are converted and piped. ``mode="images"``
+    writes ``<name>_00000.jpg``, ... next to ``outputpath``; ``mode="video"``
+    encodes the samples into ``outputpath`` at ``playback_fps``.
+    ``progress(frames, paths)`` is called after every sample. Returns
+    (succeeded, paths, thumbnail_frame).
+    """
+    pix_fmt = "bgr24" if mode == "video" else "rgb24"
+    size = {}
+
+    def reopen():
+        if "url" in camera:
+            StreamingServerSource.forget(camera["url"])
+        stream_url = camera_stream_url(camera)
+        if stream_url is None:
+            raise ValueError("no stream found")
+        streamer, probe = StreamingServerSource.open_pipe(stream_url, pix_fmt, 1 / interval)
+        if size and (probe["width"], probe["height"]) != (size["width"], size["height"]):
+            streamer.kill()
+            raise ValueError(f"stream came back as {probe['width']}X{probe['height']}")
+        return streamer, probe
+
+    count = max(1, int(duration // interval))
+    deadline = time.monotonic() + duration + OPEN_TIMEOUT + RECORD_GRACE
+    try:
+        streamer, probe = reopen()
+    except Exception as e:
+        logging.warning(f"Timelapse of {camera_key(camera)} could not start: {e}")
+        return False, [], None
+    width, height = size["width"], size["height"] = probe["width"], probe["height"]
+    logging.info(f"Sampling {count} frames every {interval} seconds into {outputpath} ({mode})")
+    base = os.path.splitext(os.path.basename(outputpath))[0]
+    fdir = os.path.dirname(outputpath)
+    mkdir(fdir)
+    recorder = VideoRecorder(width, height, fps=playback_fps, ffmpeg=ffmpeg_path()) if mode == "video" else None
+    reader = FrameReader(streamer.stdout, width, height)
+    # samples are interval seconds apart, so a stall is only noticed after that
+    watchdog = StallWatchdog(interval + STALL_TIMEOUT, streamer.kill, OPEN_TIMEOUT)
+    paths, thumbnail_frame = [], None
+    frames = 0
+    while frames < count:
+        frame = reader.read(None if recorder is None else recorder.slot())
+        if frame is None:
+            watchdog.stop()
+            streamer.kill()
+            logging.warning(f"Stream dropped after {frames}/{count} samples")
+            lost = time.monotonic()
+            reopened = StreamingServerSource.reconnect(reopen, deadline)
+            if reopened is None:
+                streamer = None
+                break
+            streamer, _ = reopened
+            if gaps is not None:
+                gaps.append({"at": round(frames * interval, 3), "duration": round(time.monotonic() - lost, 3)})
+            reader = FrameReader(streamer.stdout, width, height)
+            watchdog = StallWatchdog(interval + STALL_TIMEOUT, streamer.kill, OPEN_TIMEOUT)
+            continue
+        watchdog.feed()
+        frames += 1
+        if recorder is not None:
+            recorder.write(frame)
         else:
-            logging.warning(f"Request might have failed. No json response received")
-    except requests.exceptions.ConnectionError:
-        logging.error(
-            f"Warning: failed to inform backend server ({backend_server}) for change in the status "
-            f"of: {registry_key} due to ConnectionError"
-        )
-    except requests.exceptions.Timeout:
-        logging.error(
-            f"Warning: failed to inform backend server ({backend_server}) for change in the status "
-            f"of: {registry_key} due to Timeout"
-        )
-    except requests.exceptions.HTTPError:
-        logging.error(
-            f"Warning: failed to inform backend server ({backend_server}) for change in the status "
-            f"of: {registry_key} due to HTTPError"
-        )
+            path = os.path.join(fdir, f"{base}_{frames - 1:05d}.jpg")
+            write_jpeg(frame, path, **(jpeg_options or {}))
+            paths.append(path)
+            if thumbnail_frame is None:
+                thumbnail_frame = frame.copy()
+        if progress is not None:
+            progress(frames, paths)
+        if time.monotonic() > deadline:
+            logging.warning(f"Source is too slow. Stopping after {frames}/{count} samples")
+            break
+    watchdog.stop()
+    if streamer is not None:
+        streamer.kill()
+    metrics.count("frames_read", frames)
+    if recorder is None:
+        return bool(paths), paths, thumbnail_frame
+    recorded, tmp_path, thumbnail_frame = recorder.release()
+    if not recorded:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False, [], None
+    move(tmp_path, outputpath)
+    return True, [outputpath], thumbnail_frame
+
+def post_back(registry_key,capture_status,**details):
+    # delivery (retries included) happens in the outbox thread, so the
+    # capture does not wait for the backend
+    resp = message(True, "capture completed")
+    resp["capture_status"] = capture_status
+    resp.update(details)
+    summary = metrics.summary()
+    if summary is not None:
+        resp["metrics"] = summary
+    logging.info(f"Queuing new status {capture_status} for {registry_key}")
+    get_outbox().post(registry_key, resp)
+
+def call_with_timeout(fn, timeout, *args):
+    # runs fn in its own thread so a hung camera cannot block the caller; fn
+    # kills its ffmpeg process at the deadline, so a timed out capture does
+    # not keep decoding after its caller moved on
+    result = {}
+    context = contextvars.copy_context()
+    context.run(capture_deadline.set, time.monotonic() + timeout)
+
+    def target():
+        try:
+            result["value"] = context.run(fn, *args)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        thread.join(STOP_GRACE)
+        if thread.is_alive():
+            logging.warning(f"Capture is still running {STOP_GRACE} seconds after its deadline")
+        raise TimeoutError(f"no result after {timeout} seconds")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
 
 class CaptureRunner:
     @staticmethod
-    def capture(registry_key, camera, output_path, **args):
+    def jpeg_options(args):
+        # quality, progressive and optimize may come with any image job
+        return {k: args[k] for k in ("quality", "progressive", "optimize") if k in args}
+
+    @staticmethod
+    def save_image(image, thumbnail, output_path, **jpeg_options):
+        fdir = os.path.dirname(output_path)
+        logging.info(f"Making directory {fdir}")
+        mkdir(fdir)
+        write_jpeg(image, output_path, **jpeg_options)
+
+        thumbnail_path = f"{os.path.splitext(output_path)[0]}_260.jpg"
+        logging.info(f"Creating thumbnail image {thumbnail_path}")
+        if thumbnail is None:
+            thumbnail = thumbnail_of(image)
+        write_jpeg(thumbnail, thumbnail_path, **jpeg_options)
+
+    @staticmethod
+    def snapshot_key(camera, max_size, jpeg_options):
+        # the same camera with the same output settings gives the same files
+        return (camera_key(camera), max_size, tuple(sorted(jpeg_options.items())))
+
+    @staticmethod
+    def serve_cached(registry_key, camera, output_path, max_size=None, max_age=None, **args):
+        """Answers an image job from the snapshot cache, if it has a fresh
+        enough entry, and returns whether it did."""
+        max_age = SNAPSHOT_MAX_AGE if max_age is None else float(max_age)
+        if max_age <= 0:
+            return False
+        max_size = int(max_size) if max_size else None
+        cache_key = CaptureRunner.snapshot_key(camera, max_size, CaptureRunner.jpeg_options(args))
+        mkdir(os.path.dirname(output_path))
+        paths = (output_path, f"{os.path.splitext(output_path)[0]}_260.jpg")
+        if not get_snapshot_cache().serve(cache_key, max_age, paths):
+            return False
+        post_back(registry_key, "SUCCEEDED", cached=True)
+        return True
+
+    @staticmethod
+    def capture(registry_key, camera, output_path, max_size=None, skip_unchanged=False,
+                motion_threshold=CHANGE_THRESHOLD, max_age=None, **args):
         logging.info(f"Capturing image for {registry_key} from {camera} and store it in {output_path}")
-        image = capture_image(camera)
+        max_size = int(max_size) if max_size else None
+        max_age = SNAPSHOT_MAX_AGE if max_age is None else float(max_age)
+        jpeg_options = CaptureRunner.jpeg_options(args)
+        paths = (output_path, f"{os.path.splitext(output_path)[0]}_260.jpg")
+        cache_key = CaptureRunner.snapshot_key(camera, max_size, jpeg_options)
+
+        image, thumbnail = capture_image(camera, max_size)
         #image = np.ones((100,100,3),dtype=np.uint8)
-        if image is not None:
-            fdir = os.path.dirname(output_path)
-            logging.info(f"Making directory {fdir}")
-            mkdir(fdir)
-            img = Image.fromarray(image)
-            with open(os.path.relpath(output_path), "wb") as f:
-                byteImgIO = io.BytesIO()
-                img.save(byteImgIO, "JPEG")
-                byteImgIO.seek(0)
-                byteImg = byteImgIO.read()
-                f.write(byteImg)
-            
-            thumbnail_path = f"{os.path.splitext(output_path)[0]}_260.jpg"
-            logging.info(f"Creating thumbnail image {thumbnail_path}")
-            with open(os.path.relpath(thumbnail_path), "wb") as f:
-                byteImgIO = io.BytesIO()
-                img.thumbnail((260,260))
-                logging.info(f"thumbnail size {img.size}")
-                img.save(byteImgIO, "JPEG")
-                byteImgIO.seek(0)
-                byteImg = byteImgIO.read()
-                f.write(byteImg)
+        if image is not None and skip_unchanged and not CaptureRunner.snapshot_changed(
+            camera, image, motion_threshold, output_path
+        ):
+            logging.info(f"Snapshot of {camera_key(camera)} did not change. Not storing it")
+            capture_status = "UNCHANGED"
+        elif image is not None:
+            CaptureRunner.save_image(image, thumbnail, output_path, **jpeg_options)
+            if max_age > 0:
+                get_snapshot_cache().put(cache_key, paths)
             capture_status = "SUCCEEDED"
         else:
             capture_status = "FAILED"
 
         post_back(registry_key,capture_status)
-    
+
+    @staticmethod
+    def snapshot_changed(camera, image, threshold, output_path):
+        key = camera_key(camera)
+        path = os.path.join(
+            SNAPSHOT_REFERENCE_DIR or os.path.dirname(output_path),
+            f".reference_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.npy",
+        )
+        motion = snapshot_references.get(key)
+        if motion is None or motion.threshold != float(threshold):
+            motion = MotionFilter(threshold)
+            motion.load(path, SNAPSHOT_REFERENCE_TTL)
+            snapshot_references.set(key, motion)
+        if not motion.changed(image):
+            return False
+        mkdir(os.path.dirname(path))
+        motion.save(path)
+        return True
+
+    @staticmethod
+    def capture_one(camera, output_path, timeout, max_size=None, jpeg_options=None):
+        try:
+            image, thumbnail = call_with_timeout(capture_image, timeout, camera, max_size)
+            if image is None:
+                return "FAILED"
+            CaptureRunner.save_image(image, thumbnail, output_path, **(jpeg_options or {}))
+            return "SUCCEEDED"
+        except TimeoutError:
+            logging.warning(f"Capturing from {camera_key(camera)} timed out after {timeout} seconds")
+            return "TIMEOUT"
+        except Exception as e:
+            logging.warning(f"Capturing from {camera_key(camera)} failed: {e}")
+            return "FAILED"
+
     @staticmethod
-    def record(registry_key, camera, output_path, length=60, **args):
+    def capture_many(registry_key, captures, parallelism=8, timeout=30, max_size=None, **args):
+        """Snapshots many cameras concurrently.
+
+        ``captures`` is a list of ``{"camera": ..., "output_path": ...}``.
+        Each camera gets at most ``timeout`` seconds, and one post-back
+        reports the status of every camera.
+        """
+        parallelism, timeout = int(parallelism), float(timeout)
+        max_size = int(max_size) if max_size else None
+        jpeg_options = CaptureRunner.jpeg_options(args)
+        logging.info(f"Capturing {len(captures)} images for {registry_key} with parallelism {parallelism}")
+        # each capture runs in a copy of this context, so its spans add up in the job's trace
+        contexts = [contextvars.copy_context() for _ in captures]
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(captures)))) as executor:
+            statuses = list(
+                executor.map(
+                    lambda c, context: context.run(
+                        CaptureRunner.capture_one,
+                        c["camera"], c["output_path"], timeout, max_size, jpeg_options,
+                    ),
+                    captures,
+                    contexts,
+                )
+            )
+        results = [
+            {"output_path": c["output_path"], "capture_status": status}
+            for c, status in zip(captures, statuses)
+        ]
+        succeeded = statuses.count("SUCCEEDED")
+        logging.info(f"{succeeded}/{len(captures)} images captured")
+        if succeeded == len(captures):
+            capture_status = "SUCCEEDED"
+        elif succeeded == 0:
+            capture_status = "FAILED"
+        else:
+            capture_status = "PARTIAL"
+        post_back(registry_key, capture_status, captures=results)
+
+    @staticmethod
+    def record(registry_key, camera, output_path, length=60, mode="transcode", fps=None, preroll=0,
+               motion=None, motion_threshold=CHANGE_THRESHOLD, min_idle=1, **args):
         # in case string
         length = int(length)
+        fps = float(fps) if fps else None
+        preroll = float(preroll)
+        # motion is "drop" (idle stretches are cut) or "mark" (only reported)
+        motion_filter = None
+        if motion in ("drop", "mark") and mode == "transcode":
+            motion_filter = MotionFilter(motion_threshold, min_idle=min_idle, drop=motion == "drop")
+        elif motion:
+            logging.warning(f"Motion filtering ({motion}) is not done for {mode} recordings")
+        # where the source dropped and was reconnected, in seconds of the clip
+        gaps = []
 
-        logging.info(f"Recording video with camera {camera} for {length} seconds")
-        recorded, tmp_path,thumbnail_frame = record_video(camera, length, output_path)
+        logging.info(f"Recording video with camera {camera} for {length} seconds ({mode})")
+        if mode == "segmented":
+            return CaptureRunner.record_segments(registry_key, camera, output_path, length, **args)
+        buffer = watcher.get(camera) if preroll else None
+        if preroll and buffer is None:
+            logging.warning(f"{camera_key(camera)} is not watched. Recording without pre-roll")
+        if buffer is not None:
+            # the stream is already open; past packets come from the buffer
+            recorded, tmp_path,thumbnail_frame = record_preroll(buffer, preroll, length, output_path)
+        elif mode == "copy":
+            # packets are remuxed as they are, no decoding
+            recorded, tmp_path,thumbnail_frame = remux_video(camera, length, output_path)
+        else:
+            recorded, tmp_path,thumbnail_frame = record_video(
+                camera, length, output_path, fps, motion_filter, gaps
+            )
         logging.info(f"Video recorded? {recorded}")
         if recorded:
             fdir = os.path.dirname(output_path)
             logging.info(f"Making directory {fdir}")
             mkdir(fdir)
             logging.info(f"Moving recording from {tmp_path} to {output_path}")
-            put(tmp_path,output_path)
+            move(tmp_path,output_path)
             thumbnail_path = f"{os.path.splitext(output_path)[0]}_260.jpg"
             logging.info(f"Creating thumbnail image {thumbnail_path}")
-            with open(os.path.relpath(thumbnail_path), "wb") as f:
-                byteImgIO = io.BytesIO()
-                img = Image.fromarray(thumbnail_frame)
-                img.thumbnail((260,260))
-                img.save(byteImgIO, "JPEG")
-                byteImgIO.seek(0)
-                byteImg = byteImgIO.read()
-                f.write(byteImg)
-
-            logging.info(f"Removing {tmp_path}")
-            #os.remove(tmp_path)
+            write_jpeg(
+                thumbnail_of(thumbnail_frame), thumbnail_path, **CaptureRunner.jpeg_options(args)
+            )
             capture_status = "SUCCEEDED"
         else:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                logging.info(f"Removing {tmp_path}")
+                os.remove(tmp_path)
             capture_status = "FAILED"
         
-        post_back(registry_key,capture_status)
+        details = {"gaps": gaps} if gaps else {}
+        if motion_filter is not None:
+            # seconds of the source, so dropped stretches can be told apart
+            details["idle"] = motion_filter.idle
+        post_back(registry_key, capture_status, **details)
+
+    @staticmethod
+    def record_segments(registry_key, camera, output_path, length, segment_length=10, **args):
+        recorded, segments, thumbnail_frame = record_segmented(
+            camera, length, output_path, float(segment_length)
+        )
+        logging.info(f"Recorded {len(segments)} segments")
+        if recorded:
+            thumbnail_path = f"{os.path.splitext(output_path)[0]}_260.jpg"
+            logging.info(f"Creating thumbnail image {thumbnail_path}")
+            if thumbnail_frame is not None:
+                write_jpeg(
+                    thumbnail_of(thumbnail_frame), thumbnail_path, **CaptureRunner.jpeg_options(args)
+                )
+            capture_status = "SUCCEEDED"
+        else:
+            capture_status = "FAILED"
+
+        post_back(registry_key, capture_status, segments=segments)
         
     @staticmethod
-    def generate_thumbnail(video_file, output_path, **args):
-        thumbnail = generate_thumbnail(video_file)
+    def timelapse(registry_key, camera, output_path, interval=10, duration=600, mode="images",
+                  playback_fps=25, progress_interval=None, **args):
+        interval, duration = float(interval), float(duration)
+        progress_interval = float(progress_interval) if progress_interval else None
+        last_progress = [time.monotonic()]
+
+        def progress(frames, paths):
+            # a newer status replaces an undelivered one, so this never piles up
+            if progress_interval and time.monotonic() - last_progress[0] >= progress_interval:
+                last_progress[0] = time.monotonic()
+                post_back(registry_key, "RUNNING", frames=frames, images=list(paths))
+
+        gaps = []
+        recorded, paths, thumbnail_frame = record_timelapse(
+            camera, duration, interval, output_path, mode, float(playback_fps),
+            CaptureRunner.jpeg_options(args), progress, gaps,
+        )
+        logging.info(f"Timelapse recorded? {recorded}")
+        if recorded:
+            thumbnail_path = f"{os.path.splitext(output_path)[0]}_260.jpg"
+            logging.info(f"Creating thumbnail image {thumbnail_path}")
+            write_jpeg(
+                thumbnail_of(thumbnail_frame), thumbnail_path, **CaptureRunner.jpeg_options(args)
+            )
+            capture_status = "SUCCEEDED"
+        else:
+            capture_status = "FAILED"
+        details = {"gaps": gaps} if gaps else {}
+        post_back(registry_key, capture_status, outputs=paths, **details)
+
+    @staticmethod
+    def generate_thumbnail(video_file, output_path, candidates=1, **args):
+        thumbnail = thumbnails.best_thumbnail(video_file, int(candidates))
         logging.info(f"Creating thumbnail image {output_path}")
-        img = Image.fromarray(thumbnail)
-        img.thumbnail((260,260))
-        with open(os.path.relpath(output_path), "wb") as f:
-            byteImgIO = io.BytesIO()
-            img.save(byteImgIO, "JPEG")
-            byteImgIO.seek(0)
-            byteImg = byteImgIO.read()
-            f.write(byteImg)
+        write_jpeg(thumbnail, output_path, **CaptureRunner.jpeg_options(args))
         logging.info("Thumbnail created")
         resp = message(True, "thumbnail generated")
-        return resp, 200 
+        return resp, 200
+
+    @staticmethod
+    def generate_thumbnails(registry_key=None, videos=None, directory=None, output_dir=None, candidates=5,
+                            workers=None, overwrite=False, report_path=None, progress_interval=None, **args):
+        """Thumbnails for many existing videos, on a process pool.
+
+        Videos come from the ``videos`` list and/or every video file under
+        ``directory``. Each thumbnail is the best scored of ``candidates``
+        keyframes and goes next to its video, or under ``output_dir``;
+        existing ones are skipped unless ``overwrite``. The report of every
+        video is written to ``report_path`` and its totals are posted back.
+        """
+        files = thumbnails.video_files(directory, videos)
+        # decoding is in ffmpeg, scoring and encoding in the pool processes
+        workers = int(workers) if workers else max(1, int(budget.cpu))
+        progress_interval = float(progress_interval) if progress_interval else None
+        jpeg_options = CaptureRunner.jpeg_options(args)
+        logging.info(f"Generating thumbnails for {len(files)} videos with {workers} processes")
+        results = []
+        last_progress = time.monotonic()
+        # spawned, as forking would copy the locks of this process's threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(
+                    thumbnails.thumbnail_file, f, thumbnails.thumbnail_path(f, directory, output_dir),
+                    int(candidates), bool(overwrite), jpeg_options,
+                ): f
+                for f in files
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # a worker that died (BrokenProcessPool) fails its video, not the job
+                    video_file = futures[future]
+                    logging.warning(f"Thumbnail of {video_file} failed in the pool: {e}")
+                    results.append({
+                        "video": video_file,
+                        "thumbnail": thumbnails.thumbnail_path(video_file, directory, output_dir),
+                        "status": "FAILED",
+                        "error": str(e) or type(e).__name__,
+                    })
+                if registry_key and progress_interval and time.monotonic() - last_progress >= progress_interval:
+                    last_progress = time.monotonic()
+                    post_back(registry_key, "RUNNING", done=len(results), total=len(files))
+        totals = {s: sum(r["status"] == s for r in results) for s in ("SUCCEEDED", "SKIPPED", "FAILED")}
+        logging.info(f"Thumbnails: {totals}")
+        metrics.count("thumbnails", totals["SUCCEEDED"])
+        report = {"total": len(files), **{s.lower(): n for s, n in totals.items()}}
+        if report_path:
+            mkdir(os.path.dirname(report_path))
+            with open(report_path, "w") as f:
+                json.dump({**report, "results": results}, f, indent=2)
+        if totals["FAILED"] == 0:
+            capture_status = "SUCCEEDED"
+        elif totals["FAILED"] == len(files):
+            capture_status = "FAILED"
+        else:
+            capture_status = "PARTIAL"
+        failures = [{"video": r["video"], "error": r["error"]} for r in results if r["status"] == "FAILED"]
+        if registry_key:
+            post_back(registry_key, capture_status, report=report, failures=failures)
+        resp = message(capture_status != "FAILED", "thumbnails generated")
+        resp["report"] = report
+        return resp, 200
+
+    @staticmethod
+    def watch(camera, seconds=10, **args):
+        seconds = float(seconds)
+        stream_url = camera_stream_url(camera)
+        if stream_url is None:
+            return err_resp("no stream found", "stream_not_found", 404)
+        watcher.watch(camera, stream_url, seconds, ffmpeg_path())
+        return message(True, f"keeping the last {seconds} seconds"), 200
+
+    @staticmethod
+    def unwatch(camera, **args):
+        watcher.unwatch(camera)
+        return message(True, "camera is not watched anymore"), 200
+
+    @staticmethod
+    def export(camera, slots=4, **args):
+        # consumers attach to the ring with shm.FrameRingReader(name)
+        name = exporter.export(camera, int(slots))
+        resp = message(True, "exporting frames to shared memory")
+        resp["name"] = name
+        return resp, 200
+
+    @staticmethod
+    def unexport(camera, **args):
+        exporter.unexport(camera)
+        return message(True, "frames are not exported anymore"), 200
+
+    @staticmethod
+    def probe_size(camera):
+        # probes are cached, so opening the stream afterwards does not probe again
+        stream_url = camera_stream_url(camera)
+        if stream_url is None:
+            return None
+        probe = StreamingServerSource.probe_cached(stream_url)
+        return probe["width"], probe["height"], StreamingServerSource.frame_rate(probe)
+
+    @staticmethod
+    def source_size(capture_dict):
+        """``(width, height, rate, shared)`` of a job's source, or None.
+
+        A transcode on an open camera session takes them from the session
+        without touching the stream; everything else is probed.
+        """
+        camera = capture_dict["camera"]
+        session = sessions.peek(camera) if sessions.enabled else None
+        if (
+            session is not None and session.frame is not None and capture_dict["type"] == "video"
+            and capture_dict.get("mode", "transcode") == "transcode"
+        ):
+            height, width = session.frame.shape[:2]
+            return width, height, session.rate() or 30, True
+        size = CaptureRunner.probe_size(camera)
+        return None if size is None else (*size, False)
+
+    @staticmethod
+    def estimate(capture_dict, source=None):
+        """Cost of a job as it would run now.
+
+        Images are charged a flat cost, so they never wait for a probe (a
+        warm session or a cached snapshot answers in milliseconds); other
+        jobs are priced from ``source``, see ``source_size``.
+        """
+        kind = capture_dict["type"]
+        if kind == "image":
+            camera = capture_dict["camera"]
+            return estimate("image", *NOMINAL_SIZE, shared=sessions.enabled and sessions.peek(camera) is not None)
+        if kind == "image_batch":
+            parallelism = min(int(capture_dict.get("parallelism", 8)), len(capture_dict["captures"]))
+            one = estimate("image", *NOMINAL_SIZE)
+            return Cost(one.memory * parallelism, one.disk * parallelism, one.cpu * parallelism)
+        if kind == "thumbnails":
+            # one process per worker, each decoding or encoding at a time
+            workers = int(capture_dict.get("workers") or max(1, int(budget.cpu)))
+            return Cost(memory=workers * PROCESS_MEMORY, cpu=workers)
+        if source is None:
+            # the job fails on its own, without decoding anything
+            return Cost()
+        width, height, rate, shared = source
+        if kind == "timelapse":
+            samples = float(capture_dict.get("duration", 600)) / float(capture_dict.get("interval", 10))
+            return estimate("timelapse", width, height, rate, samples=samples)
+        if kind == "watch":
+            return estimate("watch", width, height, rate, float(capture_dict.get("seconds", 10)))
+        if kind == "export":
+            return estimate("export", width, height, rate, samples=int(capture_dict.get("slots", 4)))
+        fps = float(capture_dict.get("fps") or rate)
+        return estimate("video", width, height, fps, float(capture_dict.get("length", 60)),
+                        capture_dict.get("mode", "transcode"), shared=shared, source_fps=rate)
+
+    @staticmethod
+    def admit(capture_dict):
+        """Estimates what a job costs and reserves it in the budget.
+
+        A job that could never fit is downgraded where that helps (fewer
+        fps for a transcode, less parallelism for a batch or bulk
+        thumbnails) and rejected otherwise; one that fits waits for running
+        jobs to release enough. Returns ``(cost, job, None)`` with the job
+        to run, or ``(None, None, reason)``.
+        """
+        job = dict(capture_dict)
+        kind = job["type"]
+        if kind == "video" and float(job.get("length", 60)) > MAX_LENGTH:
+            return None, None, f"recordings are limited to {MAX_LENGTH:.0f} seconds"
+        source = None
+        if kind in PROBED:
+            source = CaptureRunner.source_size(job)
+        cost = CaptureRunner.estimate(job, source)
+        if cost.cpu > budget.cpu and kind == "video" and job.get("mode", "transcode") == "transcode":
+            # frames are decimated after the decoder, which keeps running at the source rate
+            width, height, rate, shared = source
+            fps = float(job.get("fps") or rate)
+            job["fps"] = min(fps, fps_within(budget.cpu, width, height, rate, shared))
+            logging.info(f"Downgrading recording from {fps} to {job['fps']} fps to fit {budget.cpu} cores")
+            cost = CaptureRunner.estimate(job, source)
+        elif cost.cpu > budget.cpu and kind == "image_batch":
+            job["parallelism"] = max(1, int(budget.cpu / estimate("image", *NOMINAL_SIZE).cpu))
+            logging.info(f"Downgrading batch to parallelism {job['parallelism']} to fit {budget.cpu} cores")
+            cost = CaptureRunner.estimate(job)
+        elif cost.cpu > budget.cpu and kind == "thumbnails":
+            job["workers"] = max(1, int(budget.cpu))
+            logging.info(f"Downgrading thumbnails to {job['workers']} processes to fit {budget.cpu} cores")
+            cost = CaptureRunner.estimate(job)
+        if cost.memory > budget.memory or cost.disk > budget.disk:
+            return None, None, f"job needs {cost}, over the budget"
+        logging.info(f"Admitting {kind} job needing {cost}")
+        with metrics.span("admission"):
+            if not budget.acquire(cost, ADMISSION_QUEUE_TIMEOUT):
+                return None, None, f"no room for {cost} in {ADMISSION_QUEUE_TIMEOUT:.0f} seconds"
+        return cost, job, None
+
+    @staticmethod
+    def release(kind, camera):
+        # an unwatch or unexport frees what its watch or export reserved
+        cost = reservations.pop((STOPPED_BY[kind], camera_key(camera)), None)
+        if cost is not None:
+            budget.release(cost)
 
     @staticmethod
     def run_from_dict(capture_dict):
+        kind = capture_dict.get("type")
+        with metrics.trace(kind, capture_dict.get("registry_key")):
+            try:
+                return CaptureRunner.admit_and_dispatch(kind, capture_dict)
+            except Exception as error:
+                # malformed jobs (missing camera or output_path, bad numbers)
+                logging.error(error)
+                return internal_err_resp()
+
+    @staticmethod
+    def admit_and_dispatch(kind, capture_dict):
+        # a cached snapshot is served before admission, without stream contact
+        if kind == "image" and CaptureRunner.serve_cached(**capture_dict):
+            return
+        if kind in STOPPED_BY:
+            rv = CaptureRunner.dispatch(capture_dict)
+            CaptureRunner.release(kind, capture_dict["camera"])
+            return rv
+        if kind not in ADMITTED or (
+            kind in STANDING and (kind, camera_key(capture_dict["camera"])) in reservations
+        ):
+            return CaptureRunner.dispatch(capture_dict)
+        try:
+            cost, job, reason = CaptureRunner.admit(capture_dict)
+        except Exception as error:
+            logging.error(f"Admission failed: {error}")
+            cost, job, reason = Cost(), capture_dict, None
+        if job is None:
+            logging.warning(f"Rejecting {kind} job {capture_dict.get('registry_key')}: {reason}")
+            if capture_dict.get("registry_key"):
+                post_back(capture_dict["registry_key"], "FAILED", reason=reason)
+            return err_resp(reason, "over_budget", 429)
+        rv = None
+        try:
+            rv = CaptureRunner.dispatch(job)
+            return rv
+        finally:
+            if kind in STANDING and isinstance(rv, tuple) and rv[1] == 200:
+                # the stream stays open after the job; its unwatch or unexport releases it
+                reservations[(kind, camera_key(job["camera"]))] = cost
+            else:
+                budget.release(cost)
+
+    @staticmethod
+    def dispatch(capture_dict):
         try:
             logging.info(capture_dict)
             if capture_dict["type"] == "image":
                 return CaptureRunner.capture(**capture_dict)
+            elif capture_dict["type"] == "image_batch":
+                return CaptureRunner.capture_many(**capture_dict)
             elif capture_dict["type"] == "video":
                 return  CaptureRunner.record(**capture_dict)
+            elif capture_dict["type"] == "timelapse":
+                return CaptureRunner.timelapse(**capture_dict)
             elif capture_dict["type"] == "thumbnail":
                 return CaptureRunner.generate_thumbnail(**capture_dict)
+            elif capture_dict["type"] == "thumbnails":
+                return CaptureRunner.generate_thumbnails(**capture_dict)
+            elif capture_dict["type"] == "watch":
+                return CaptureRunner.watch(**capture_dict)
+            elif capture_dict["type"] == "unwatch":
+                return CaptureRunner.unwatch(**capture_dict)
+            elif capture_dict["type"] == "export":
+                return CaptureRunner.export(**capture_dict)
+            elif capture_dict["type"] == "unexport":
+                return CaptureRunner.unexport(**capture_dict)
         except Exception as error:
             logging.error(error)
             return internal_err_resp()
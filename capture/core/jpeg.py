@@ -0,0 +1,47 @@
+import logging
+import os
+import time
+
+from PIL import Image
+
+from . import metrics
+from .utils import random_string
+
+# PIL's own default, which is what captures were always written with
+DEFAULT_QUALITY = 75
+
+
+def write_jpeg(frame, path, quality=DEFAULT_QUALITY, progressive=False, optimize=False):
+    """Encodes an rgb frame straight into ``path`` and returns the bytes written.
+
+    Pillow encodes with libjpeg(-turbo) directly into the open file, with no
+    intermediate buffers. The image goes to a temp file next to ``path`` that
+    is renamed over it, so readers never see a partial jpeg.
+    """
+    start = time.perf_counter()
+    path = os.path.relpath(path)
+    tmp_path = f"{path}.{random_string()}.tmp"
+    img = Image.fromarray(frame)
+    try:
+        with open(tmp_path, "wb") as f:
+            img.save(
+                f,
+                "JPEG",
+                quality=int(quality),
+                progressive=bool(progressive),
+                optimize=bool(optimize),
+            )
+            size = f.tell()
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    elapsed = time.perf_counter() - start
+    metrics.add("encode_jpeg", elapsed)
+    metrics.count("bytes_written", size)
+    logging.info(
+        f"Encoded {img.size[0]}x{img.size[1]} jpeg {path} ({size} bytes) "
+        f"in {elapsed * 1000:.1f} ms"
+    )
+    return size
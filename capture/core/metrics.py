@@ -0,0 +1,143 @@
+import collections
+import contextlib
+import contextvars
+import logging
+import resource
+import threading
+import time
+
+# the trace of the job running in the current thread/context, if any
+current = contextvars.ContextVar("capture_trace", default=None)
+
+
+class JobTrace:
+    """Timing spans and counters of one capture job.
+
+    Spans with the same name are summed (e.g. ``read`` over every frame),
+    so hot loops can report without a log line or an allocation per frame.
+    """
+
+    def __init__(self, kind=None, registry_key=None):
+        self.kind = kind
+        self.registry_key = registry_key
+        self.start = time.perf_counter()
+        self.spans = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.spans[name] += seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def summary(self):
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            return {
+                "type": self.kind,
+                "wall_time": round(time.perf_counter() - self.start, 6),
+                "spans": {name: round(seconds, 6) for name, seconds in self.spans.items()},
+                "counters": dict(self.counters),
+                # ru_maxrss is in KiB on linux; children are ffmpeg processes
+                "peak_rss_bytes": own.ru_maxrss * 1024,
+                "peak_child_rss_bytes": children.ru_maxrss * 1024,
+            }
+
+
+class Collector:
+    """Totals over every finished job, for the Prometheus endpoint."""
+
+    def __init__(self):
+        self.jobs = collections.Counter()
+        self.job_seconds = collections.defaultdict(float)
+        self.span_seconds = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def observe(self, summary):
+        kind = summary["type"] or "unknown"
+        with self.lock:
+            self.jobs[kind] += 1
+            self.job_seconds[kind] += summary["wall_time"]
+            for name, seconds in summary["spans"].items():
+                self.span_seconds[(kind, name)] += seconds
+            for name, n in summary["counters"].items():
+                self.counters[(kind, name)] += n
+
+    def prometheus(self):
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        lines = [
+            "# TYPE capture_jobs_total counter",
+            "# TYPE capture_job_seconds_total counter",
+            "# TYPE capture_stage_seconds_total counter",
+            "# TYPE capture_events_total counter",
+            "# TYPE capture_peak_rss_bytes gauge",
+        ]
+        with self.lock:
+            for kind, n in sorted(self.jobs.items()):
+                lines.append(f'capture_jobs_total{{type="{kind}"}} {n}')
+                lines.append(f'capture_job_seconds_total{{type="{kind}"}} {self.job_seconds[kind]:.6f}')
+            for (kind, name), seconds in sorted(self.span_seconds.items()):
+                lines.append(f'capture_stage_seconds_total{{type="{kind}",stage="{name}"}} {seconds:.6f}')
+            for (kind, name), n in sorted(self.counters.items()):
+                lines.append(f'capture_events_total{{type="{kind}",event="{name}"}} {n}')
+        process_summary = process.summary()
+        if process_summary["spans"] or process_summary["counters"]:
+            lines.append("# TYPE capture_process_seconds_total counter")
+            lines.append("# TYPE capture_process_events_total counter")
+        for name, seconds in sorted(process_summary["spans"].items()):
+            lines.append(f'capture_process_seconds_total{{stage="{name}"}} {seconds:.6f}')
+        for name, n in sorted(process_summary["counters"].items()):
+            lines.append(f'capture_process_events_total{{event="{name}"}} {n}')
+        lines.append(f"capture_peak_rss_bytes {own.ru_maxrss * 1024}")
+        return "\n".join(lines) + "\n"
+
+
+collector = Collector()
+# work done outside of any job: service discovery and login at start-up,
+# and post-backs, which the outbox thread delivers after their job ended
+process = JobTrace("process")
+
+
+@contextlib.contextmanager
+def trace(kind=None, registry_key=None):
+    job_trace = JobTrace(kind, registry_key)
+    token = current.set(job_trace)
+    try:
+        yield job_trace
+    finally:
+        current.reset(token)
+        summary = job_trace.summary()
+        collector.observe(summary)
+        logging.info(f"Job {registry_key} ({kind}) took {summary['wall_time']:.3f}s: {summary['spans']}")
+
+
+@contextlib.contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+def add(name, seconds):
+    (current.get() or process).add(name, seconds)
+
+
+def count(name, n=1):
+    (current.get() or process).count(name, n)
+
+
+def summary():
+    job_trace = current.get()
+    if job_trace is None:
+        return None
+    rv = job_trace.summary()
+    # start-up and earlier deliveries, so one-shot jobs report them too
+    rv["process"] = {k: v for k, v in process.summary().items() if k in ("spans", "counters")}
+    return rv
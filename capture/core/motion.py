@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+# a pixel changed when its gray level moved by more than this (0-255)
+PIXEL_THRESHOLD = 25
+# a frame changed when more than this fraction of its pixels changed
+CHANGE_THRESHOLD = 0.01
+# frames are compared at about SIZE x SIZE
+SIZE = 64
+
+
+def downscale_gray(frame, size=SIZE):
+    """A small float32 gray version of an rgb or bgr frame.
+
+    Strided sampling plus a channel mean: no allocation at full resolution
+    and no dependency on the channel order.
+    """
+    height, width = frame.shape[:2]
+    step = max(1, max(height, width) // size)
+    return frame[::step, ::step].mean(axis=2, dtype=np.float32)
+
+
+class MotionFilter:
+    """Tells frames that differ from the last changed frame from idle ones.
+
+    Frames are compared with the last frame that counted as changed (not
+    with the previous frame), so slow changes add up until they pass the
+    threshold. ``observe`` also tracks the idle stretches of a recording
+    that last ``min_idle`` seconds or more. With ``drop`` set, only the first
+    ``min_idle`` seconds of a still scene are kept; otherwise every frame is
+    kept and the idle stretches are only marked.
+    """
+
+    def __init__(self, threshold=CHANGE_THRESHOLD, pixel_threshold=PIXEL_THRESHOLD, size=SIZE,
+                 min_idle=1.0, drop=False):
+        self.drop = drop
+        self.threshold = float(threshold)
+        self.pixel_threshold = float(pixel_threshold)
+        self.size = int(size)
+        self.min_idle = float(min_idle)
+        self.reference = None
+        self.idle_since = None
+        self.idle = []
+
+    def score(self, frame):
+        """Fraction of the pixels that changed since the reference frame."""
+        small = downscale_gray(frame, self.size)
+        if self.reference is None or self.reference.shape != small.shape:
+            return 1.0, small
+        return float(np.count_nonzero(np.abs(small - self.reference) > self.pixel_threshold)) / small.size, small
+
+    def changed(self, frame):
+        score, small = self.score(frame)
+        if score <= self.threshold:
+            return False
+        self.reference = small
+        return True
+
+    def load(self, path, max_age):
+        """Takes the reference saved to ``path`` if it is no older than
+        ``max_age`` seconds, and returns whether there was one."""
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                return False
+            self.reference = np.load(path)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"Ignoring the reference frame in {path}: {e}")
+            return False
+        return True
+
+    def save(self, path):
+        # the reference is about SIZE x SIZE floats; the rename keeps readers
+        # of the file from seeing half of it
+        if self.reference is None:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.reference)
+        os.replace(tmp_path, path)
+
+    def observe(self, frame, t):
+        """Updates the idle stretches with the frame at ``t`` seconds and
+        returns whether it should be kept."""
+        if self.changed(frame):
+            self.close(t)
+            return True
+        if self.idle_since is None:
+            self.idle_since = t
+        return not self.drop or t - self.idle_since < self.min_idle
+
+    def close(self, t):
+        # ends the current idle stretch, if it was long enough to count
+        if self.idle_since is not None and t - self.idle_since >= self.min_idle:
+            self.idle.append([round(self.idle_since, 3), round(t, 3)])
+            logging.info(f"Scene was idle from {self.idle_since:.1f}s to {t:.1f}s")
+        self.idle_since = None
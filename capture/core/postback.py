@@ -0,0 +1,181 @@
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+from . import backend, metrics
+from .utils import forget_service, get_service, random_string, tempdir
+
+BACKEND_SERVICE = "falcoeye-backend"
+
+
+class Outbox:
+    """Delivers capture status updates to the backend in the background.
+
+    Updates are coalesced per registry key (only the latest status of a
+    capture is sent), kept in memory and mirrored to ``spool_dir`` so they
+    survive a restart, and drained in batches of ``batch_size`` over the
+    pooled backend session. Failed deliveries are retried with exponential
+    backoff; after ``retries`` attempts an update is left on disk for the
+    next process to pick up.
+    """
+
+    def __init__(self, spool_dir=None, timeout=(3.05, 10), retries=5, backoff=0.5, batch_size=20):
+        self.spool_dir = spool_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.sending = 0
+        self.worker = None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            self.load()
+
+    def spool_path(self, registry_key):
+        return os.path.join(self.spool_dir, re.sub(r"[^\w.-]", "_", str(registry_key)) + ".json")
+
+    def load(self):
+        for path in glob.glob(os.path.join(self.spool_dir, "*.json")):
+            try:
+                with open(path) as f:
+                    item = json.load(f)
+                self.pending[item["registry_key"]] = {"payload": item["payload"], "attempts": 0, "due": 0}
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Dropping unreadable outbox entry {path}: {e}")
+                os.remove(path)
+        if self.pending:
+            logging.info(f"Loaded {len(self.pending)} undelivered status updates")
+            self.start()
+
+    def post(self, registry_key, payload):
+        with self.cond:
+            # under the lock, so the delivery of an older status of the same
+            # job cannot forget the file once it holds this one
+            if self.spool_dir:
+                path = self.spool_path(registry_key)
+                tmp_path = f"{path}.{random_string()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"registry_key": registry_key, "payload": payload}, f)
+                os.replace(tmp_path, path)
+            # a newer status replaces one that has not been sent yet
+            self.pending[registry_key] = {"payload": payload, "attempts": 0, "due": 0}
+            self.cond.notify_all()
+        self.start()
+
+    def start(self):
+        with self.cond:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="postback", daemon=True)
+                self.worker.start()
+
+    def flush(self, timeout=30):
+        """Waits until every update was delivered or given up on."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.pending or self.sending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.warning(f"{len(self.pending)} status updates are still undelivered")
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def _next_batch(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                due = [k for k, item in self.pending.items() if item["due"] <= now]
+                if due:
+                    batch = [(k, self.pending.pop(k)) for k in due[: self.batch_size]]
+                    self.sending += len(batch)
+                    return batch
+                wait = min((item["due"] for item in self.pending.values()), default=now + 60) - now
+                self.cond.wait(max(wait, 0.01))
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            for registry_key, item in batch:
+                # no job is running on this thread, so this goes to the process trace
+                with metrics.span("postback"):
+                    delivered = self.send(registry_key, item["payload"])
+                metrics.count("postbacks_delivered" if delivered else "postbacks_failed")
+                with self.cond:
+                    self.sending -= 1
+                    if delivered:
+                        self.forget(registry_key)
+                    elif registry_key not in self.pending:
+                        item["attempts"] += 1
+                        if item["attempts"] < self.retries:
+                            item["due"] = time.monotonic() + self.backoff * 2 ** item["attempts"]
+                            self.pending[registry_key] = item
+                        else:
+                            logging.error(
+                                f"Giving up on status update of {registry_key} "
+                                f"after {item['attempts']} attempts"
+                            )
+                    self.cond.notify_all()
+
+    def forget(self, registry_key):
+        if self.spool_dir and registry_key not in self.pending:
+            try:
+                os.remove(self.spool_path(registry_key))
+            except FileNotFoundError:
+                pass
+
+    def send(self, registry_key, payload):
+        backend_server = None
+        try:
+            backend_server = get_service(BACKEND_SERVICE)
+            postback_url = f"{backend_server}/api/capture/{registry_key}"
+            logging.info(f"Posting new status {payload.get('capture_status')} to backend {postback_url}")
+            rv = backend.put(postback_url, json.dumps(payload), timeout=self.timeout)
+            if rv.status_code >= 500:
+                logging.warning(f"Backend answered {rv.status_code} for {registry_key}")
+                return False
+            if rv.headers.get("content-type", "").strip().startswith("application/json"):
+                logging.info(f"Response received {rv.json()}")
+            else:
+                logging.warning(f"Request might have failed. No json response received")
+            return True
+        except requests.exceptions.ConnectionError:
+            # the cached address might be stale
+            forget_service(BACKEND_SERVICE)
+            reason = "ConnectionError"
+        except requests.exceptions.Timeout:
+            reason = "Timeout"
+        except requests.exceptions.HTTPError:
+            reason = "HTTPError"
+        except ValueError as e:
+            # the backend could not be discovered (yet)
+            reason = str(e)
+        logging.error(
+            f"Warning: failed to inform backend server ({backend_server}) for change in the status "
+            f"of: {registry_key} due to {reason}"
+        )
+        return False
+
+
+# built on the first post, so processes that only import this module (e.g.
+# the bulk thumbnail workers) never load the spool or start a sender
+outbox = None
+outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global outbox
+    with outbox_lock:
+        if outbox is None:
+            outbox = Outbox(
+                spool_dir=os.getenv("POSTBACK_OUTBOX", os.path.join(tempdir(), "capture_outbox")),
+                retries=int(os.getenv("POSTBACK_RETRIES", 5)),
+            )
+        return outbox
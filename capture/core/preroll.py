@@ -0,0 +1,225 @@
+import collections
+import logging
+import os
+import queue
+import subprocess as sp
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .reader import StallWatchdog
+from .utils import camera_key, random_string, tempdir
+
+TS_PACKET = 188
+# ffmpeg's mpegts muxer writes PAT (pid 0), SDT (0x11) and PMT (0x1000 by
+# default) right before every video keyframe
+TABLE_PIDS = (0x0000, 0x0011, 0x1000)
+
+
+def random_access_points(chunk):
+    """Indices of the TS packets in ``chunk`` that start a keyframe."""
+    packets = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, TS_PACKET)
+    has_adaptation = (packets[:, 3] & 0x20) != 0
+    flagged = (packets[:, 4] > 0) & ((packets[:, 5] & 0x40) != 0)
+    return np.flatnonzero(has_adaptation & flagged)
+
+
+def packet_pid(data, index):
+    offset = index * TS_PACKET
+    return ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+
+
+def tables_start(data, end=None):
+    """Index of the first of the table packets that end ``data`` (at packet
+    ``end``), i.e. the ones that belong to a keyframe right after them."""
+    boundary = len(data) // TS_PACKET if end is None else end
+    while boundary > 0 and packet_pid(data, boundary - 1) in TABLE_PIDS:
+        boundary -= 1
+    return boundary
+
+
+class PrerollBuffer:
+    """Keeps the last ``seconds`` of a camera as encoded packets.
+
+    ffmpeg remuxes the source (``-c copy``) into MPEG-TS on a pipe, and the
+    packets are grouped by GOP so a clip can always start at a keyframe.
+    Memory is bounded by ``seconds`` plus one GOP of compressed video, and
+    ``record`` writes pre-roll plus post-roll without reopening the stream.
+    A source that sends nothing for ``stall_timeout`` seconds
+    (``open_timeout`` for the first packets) stops the buffer.
+    """
+
+    def __init__(self, stream_url, seconds=10, ffmpeg="ffmpeg", chunk_packets=64, stall_timeout=10,
+                 open_timeout=30):
+        self.stream_url = stream_url
+        self.seconds = seconds
+        self.ffmpeg = ffmpeg
+        self.chunk_size = chunk_packets * TS_PACKET
+        # (arrival time, bytearray starting at a keyframe)
+        self.gops = collections.deque()
+        # tables read before the first keyframe, which will start with them
+        self.lead = bytearray()
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.alive = True
+        self.pipe = sp.Popen(
+            [
+                ffmpeg,
+                "-loglevel",
+                "quiet",
+                "-i",
+                stream_url,
+                "-an",
+                "-c",
+                "copy",
+                "-f",
+                "mpegts",
+                "pipe:1",
+            ],
+            stdin=sp.DEVNULL,
+            stdout=sp.PIPE,
+        )
+        # killing ffmpeg ends the blocked read of a stalled source
+        self.watchdog = StallWatchdog(stall_timeout, self.pipe.kill, open_timeout)
+        self.thread = threading.Thread(target=self._run, name="preroll", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while self.alive:
+                chunk = self.pipe.stdout.read(self.chunk_size)
+                if len(chunk) < TS_PACKET:
+                    break
+                self.watchdog.feed()
+                chunk = chunk[: len(chunk) - len(chunk) % TS_PACKET]
+                self._append(chunk, time.monotonic())
+        finally:
+            logging.info(f"Pre-roll buffer for {self.stream_url} stopped")
+            self.watchdog.stop()
+            self.close()
+
+    def _append(self, chunk, now):
+        with self.lock:
+            for listener in self.listeners:
+                listener.put(chunk)
+            start = 0
+            for index in random_access_points(chunk):
+                boundary = max(start, tables_start(chunk, int(index)))
+                if boundary == start and start > 0:
+                    continue
+                self._extend(chunk[start * TS_PACKET:boundary * TS_PACKET])
+                if boundary == 0:
+                    self._start_gop_from_tail(now)
+                else:
+                    self.gops.append((now, bytearray()))
+                start = boundary
+            self._extend(chunk[start * TS_PACKET:])
+            self._trim(now)
+
+    def _extend(self, data):
+        if self.gops:
+            self.gops[-1][1].extend(data)
+        else:
+            # bytes before the first keyframe cannot be decoded on their own,
+            # except for the tables it needs
+            self.lead.extend(data)
+            del self.lead[:tables_start(self.lead) * TS_PACKET]
+
+    def _start_gop_from_tail(self, now):
+        # the tables preceding the keyframe may end the previous chunk
+        last = self.gops[-1][1] if self.gops else self.lead
+        boundary = tables_start(last)
+        tail = last[boundary * TS_PACKET:]
+        del last[boundary * TS_PACKET:]
+        self.gops.append((now, tail))
+
+    def _trim(self, now):
+        # the oldest gop goes once the next one alone covers the window
+        while len(self.gops) > 1 and self.gops[1][0] <= now - self.seconds:
+            self.gops.popleft()
+
+    def record(self, preroll, postroll, filename):
+        """Writes ``preroll`` seconds of the past and ``postroll`` seconds of the
+        future into a temp MPEG-TS file and returns its path (None on failure)."""
+        tempfile = f'{tempdir()}/{datetime.now().strftime("%m_%d_%Y")}_{random_string()}.ts'
+        logging.info(f"Writing {preroll}s pre-roll and {postroll}s post-roll into {tempfile} for {filename}")
+        listener = queue.Queue()
+        with self.lock:
+            now = time.monotonic()
+            gops = [g for t, g in self.gops]
+            times = [t for t, g in self.gops]
+            first = 0
+            for i, t in enumerate(times):
+                if t <= now - preroll:
+                    first = i
+            past = [bytes(g) for g in gops[first:]]
+            self.listeners.append(listener)
+        try:
+            written = 0
+            with open(tempfile, "wb") as f:
+                for data in past:
+                    f.write(data)
+                    written += len(data)
+                deadline = time.monotonic() + postroll
+                while time.monotonic() < deadline:
+                    try:
+                        data = listener.get(timeout=max(deadline - time.monotonic(), 0.01))
+                    except queue.Empty:
+                        continue
+                    if data is None:
+                        break
+                    f.write(data)
+                    written += len(data)
+        finally:
+            with self.lock:
+                self.listeners.remove(listener)
+        if written == 0:
+            os.remove(tempfile)
+            return None
+        return tempfile
+
+    def close(self):
+        with self.lock:
+            self.alive = False
+            for listener in self.listeners:
+                listener.put(None)
+        if self.pipe.poll() is None:
+            self.pipe.kill()
+
+
+class PrerollWatcher:
+    """Pre-roll buffers of the cameras that are being watched."""
+
+    def __init__(self, stall_timeout=10, open_timeout=30):
+        self.stall_timeout = stall_timeout
+        self.open_timeout = open_timeout
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def watch(self, camera, stream_url, seconds, ffmpeg):
+        key = camera_key(camera)
+        with self.lock:
+            current = self.buffers.get(key)
+            if current is not None and current.alive:
+                current.seconds = max(current.seconds, seconds)
+                return current
+            logging.info(f"Watching {key} with {seconds}s pre-roll")
+            self.buffers[key] = PrerollBuffer(
+                stream_url, seconds, ffmpeg, stall_timeout=self.stall_timeout, open_timeout=self.open_timeout
+            )
+            return self.buffers[key]
+
+    def unwatch(self, camera):
+        with self.lock:
+            buffer = self.buffers.pop(camera_key(camera), None)
+        if buffer is not None:
+            buffer.close()
+
+    def get(self, camera):
+        with self.lock:
+            buffer = self.buffers.get(camera_key(camera))
+        if buffer is None or not buffer.alive:
+            return None
+        return buffer
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+
+class FrameReader:
+    """Reads raw frames from an ffmpeg pipe straight into reused buffers.
+
+    Frames are ``readinto`` a preallocated ring of ``buffer_size`` slots (or
+    the ``out`` array given to ``read``), so the hot loop allocates nothing.
+    The returned arrays are views that get overwritten once the ring wraps
+    around; copy them if they must outlive the next reads.
+    """
+
+    def __init__(self, stream, width, height, channels=3, buffer_size=2):
+        self.stream = stream
+        self.width = width
+        self.height = height
+        self.frame_size = width * height * channels
+        self.ring = np.empty((buffer_size, height, width, channels), dtype=np.uint8)
+        self.count = 0
+
+    def read(self, out=None):
+        """Returns the next frame, or None when the stream ended.
+
+        A trailing partial frame is dropped rather than returned.
+        """
+        frame = self.ring[self.count % len(self.ring)] if out is None else out
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < self.frame_size:
+            n = self.stream.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        if filled < self.frame_size:
+            if filled > 0:
+                logging.warning(f"Dropping partial frame ({filled}/{self.frame_size} bytes)")
+            return None
+        self.count += 1
+        return frame
+
+
+class StallWatchdog:
+    """Calls ``on_stall`` once ``feed`` was not called for ``timeout`` seconds.
+
+    A blocked pipe read can not time out by itself; killing the ffmpeg
+    process behind it (the usual ``on_stall``) makes the read return, so a
+    dead source costs at most ``timeout`` seconds. ``first_timeout`` allows
+    more time for the first frame, which waits for the connection too.
+    """
+
+    def __init__(self, timeout, on_stall, first_timeout=None):
+        self.timeout = timeout
+        self.on_stall = on_stall
+        self.last = time.monotonic() + (first_timeout or timeout) - timeout
+        self.stalled = False
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+        self.thread.start()
+
+    def feed(self):
+        self.last = time.monotonic()
+
+    def _run(self):
+        while not self.done.wait(min(self.timeout / 4, 1)):
+            if time.monotonic() - self.last > self.timeout:
+                logging.warning(f"No frame for {self.timeout} seconds. Giving up on the stream")
+                self.stalled = True
+                self.on_stall()
+                return
+
+    def stop(self):
+        self.done.set()
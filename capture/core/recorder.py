@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+import subprocess as sp
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .utils import random_string, tempdir
+
+# x264 speed/size trade-off and encoder threads (0 lets x264 pick per core)
+RECORD_PRESET = os.getenv("RECORD_PRESET", "veryfast")
+RECORD_THREADS = int(os.getenv("RECORD_THREADS", 0))
+
+
+class VideoRecorder:
+    """Encodes frames into a temp mp4 while the source is still being read.
+
+    The pipeline has three stages: the caller reads frames into the
+    slots of a preallocated ring, a feeder thread writes filled slots to an
+    ffmpeg pipe, and ffmpeg converts them to yuv and encodes them with
+    multi-threaded libx264. Pipe writes and the encoder run outside the GIL,
+    so encoding overlaps reading. The ring is the bounded queue between the
+    stages: when the encoder falls behind, ``slot`` blocks until a frame was
+    written, so memory stays flat no matter how long the clip is.
+    Frames are bgr unless ``pix_fmt`` is "rgb24".
+    """
+
+    def __init__(self, width, height, fps=30, buffer_size=8, ffmpeg="ffmpeg",
+                 preset=RECORD_PRESET, threads=RECORD_THREADS, pix_fmt="bgr24"):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.pix_fmt = pix_fmt
+        self.count = 0
+        self.thumbnail_frame = None
+        # seconds the reader waited for the encoder
+        self.stalled = 0
+        self.error = None
+        self.ring = np.zeros((buffer_size, height, width, 3), dtype=np.uint8)
+        self.free = queue.Queue()
+        for index in range(buffer_size):
+            self.free.put(index)
+        self.filled = queue.Queue()
+        self.current = None
+        self.path = f'{tempdir()}/{datetime.now().strftime("%m_%d_%Y")}_{random_string()}.mp4'
+        logging.info(f"Creating temp file first {self.path}")
+        self.encoder = sp.Popen(
+            [
+                ffmpeg,
+                "-loglevel",
+                "error",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                pix_fmt,
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(fps),
+                "-i",
+                "pipe:0",
+                "-c:v",
+                "libx264",
+                "-preset",
+                preset,
+                "-threads",
+                str(threads),
+                "-pix_fmt",
+                "yuv420p",
+                "-movflags",
+                "+faststart",
+                "-y",
+                self.path,
+            ],
+            stdin=sp.PIPE,
+            stdout=sp.DEVNULL,
+        )
+        self.feeder = threading.Thread(target=self._feed, name="recorder", daemon=True)
+        self.feeder.start()
+
+    def _feed(self):
+        while True:
+            index = self.filled.get()
+            if index is None:
+                break
+            if self.error is None:
+                try:
+                    self.encoder.stdin.write(memoryview(self.ring[index]).cast("B"))
+                except (BrokenPipeError, ValueError) as e:
+                    logging.error(f"Encoder of {self.path} stopped: {e}")
+                    self.error = e
+            # a failed encoder still frees slots, so the reader never hangs
+            self.free.put(index)
+
+    def slot(self):
+        # next free frame in the ring, once the encoder is done with it
+        if self.current is None:
+            start = time.perf_counter()
+            self.current = self.free.get()
+            self.stalled += time.perf_counter() - start
+        return self.ring[self.current]
+
+    def write(self, frame):
+        slot = self.slot()
+        if not np.may_share_memory(frame, slot):
+            np.copyto(slot, frame)
+        if self.thumbnail_frame is None:
+            # thumbnails are rgb
+            self.thumbnail_frame = (slot if self.pix_fmt == "rgb24" else slot[:, :, ::-1]).copy()
+        self.filled.put(self.current)
+        self.current = None
+        self.count += 1
+
+    def release(self):
+        self.filled.put(None)
+        self.feeder.join()
+        try:
+            self.encoder.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.encoder.wait()
+        if self.encoder.returncode != 0:
+            logging.error(f"Encoding {self.path} failed with code {self.encoder.returncode}")
+        logging.info(f"Recorded {self.count} frames to {self.path}")
+        recorded = self.count > 0 and self.error is None and self.encoder.returncode == 0
+        return recorded, self.path, self.thumbnail_frame
@@ -0,0 +1,153 @@
+import collections
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import metrics
+from .capture import CaptureRunner
+from .utils import camera_key, message
+
+
+class CaptureService:
+    """Resident capture daemon.
+
+    Jobs are the same dicts ``CaptureRunner.run_from_dict`` takes. They are
+    run on a bounded thread pool (decoding happens in ffmpeg subprocesses,
+    so threads scale with cores) and at most ``per_camera`` jobs touch the
+    same camera at a time. Jobs can be submitted over HTTP (``POST /jobs``)
+    or dropped as ``*.json`` files into a spool directory. ``GET /metrics``
+    exposes per-stage timings of finished jobs in the Prometheus format.
+    Jobs are not authenticated and choose the paths they write to, so the
+    HTTP endpoint only listens on loopback unless another ``host`` is given
+    (``CAPTURE_HOST``).
+    With camera sessions on (``CAPTURE_MAX_SESSIONS``), the jobs of a camera
+    share one upstream connection, so ``per_camera`` can be raised; what
+    they may take together is bounded by the admission budgets.
+    """
+
+    def __init__(self, workers=None, per_camera=1):
+        self.workers = workers or os.cpu_count()
+        self.per_camera = per_camera
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="capture")
+        # per camera: jobs running, and jobs waiting for one of them to finish
+        self.cameras = {}
+        self.lock = threading.Lock()
+
+    def submit(self, capture_dict):
+        """Queues a job and returns a future of its result.
+
+        A job whose camera already has ``per_camera`` jobs running waits in
+        that camera's pending queue, not in the pool, so a busy camera never
+        holds workers that jobs for other cameras could use.
+        """
+        logging.info(f"Queuing {capture_dict.get('type')} job {capture_dict.get('registry_key')}")
+        future = Future()
+        camera = capture_dict.get("camera")
+        key = None if camera is None else camera_key(camera)
+        if key is not None:
+            with self.lock:
+                state = self.cameras.setdefault(key, {"running": 0, "pending": collections.deque()})
+                if state["running"] >= self.per_camera:
+                    state["pending"].append((capture_dict, future))
+                    logging.info(f"{len(state['pending'])} jobs waiting for {key}")
+                    return future
+                state["running"] += 1
+        self.executor.submit(self.run, key, capture_dict, future)
+        return future
+
+    def run(self, key, capture_dict, future):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(CaptureRunner.run_from_dict(capture_dict))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            if key is not None:
+                self.finished(key)
+
+    def finished(self, key):
+        # the slot of the finished job goes to the camera's next pending job
+        with self.lock:
+            state = self.cameras[key]
+            if state["pending"]:
+                capture_dict, future = state["pending"].popleft()
+            else:
+                state["running"] -= 1
+                if state["running"] == 0:
+                    del self.cameras[key]
+                return
+        self.executor.submit(self.run, key, capture_dict, future)
+
+    def serve_http(self, host="127.0.0.1", port=8000):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    return self._reply(200, message(True, "alive"))
+                if self.path == "/metrics":
+                    data = metrics.collector.prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    return self.wfile.write(data)
+                self._reply(404, message(False, "not found"))
+
+            def do_POST(self):
+                if self.path != "/jobs":
+                    return self._reply(404, message(False, "not found"))
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    capture_dict = json.loads(self.rfile.read(length))
+                except ValueError:
+                    return self._reply(400, message(False, "invalid json"))
+                service.submit(capture_dict)
+                self._reply(202, message(True, "capture queued"))
+
+            def log_message(self, format, *args):
+                logging.info(format % args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        logging.info(f"Accepting capture jobs on http://{host}:{port}/jobs")
+        thread = threading.Thread(target=server.serve_forever, name="capture-http", daemon=True)
+        thread.start()
+        return server
+
+    def watch_spool(self, spool_dir, interval=1):
+        logging.info(f"Watching spool directory {spool_dir}")
+        while True:
+            for job_file in sorted(glob.glob(os.path.join(spool_dir, "*.json"))):
+                claimed = f"{job_file}.claimed"
+                try:
+                    # rename is atomic, so a file is only ever picked once
+                    os.rename(job_file, claimed)
+                    with open(claimed) as f:
+                        capture_dict = json.load(f)
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Skipping spool file {job_file}: {e}")
+                    continue
+                future = self.submit(capture_dict)
+                future.add_done_callback(lambda _, path=claimed: os.remove(path))
+            time.sleep(interval)
+
+    def serve(self, host="127.0.0.1", port=8000, spool_dir=None):
+        self.serve_http(host, port)
+        if spool_dir:
+            self.watch_spool(spool_dir)
+        else:
+            threading.Event().wait()
@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .utils import camera_key
+
+
+class CameraSession:
+    """A warm decoder for one camera.
+
+    The stream is resolved and opened once; a background thread keeps
+    draining it so ``latest`` always returns the most recent frame without
+    paying for stream resolution, probing or ffmpeg startup again.
+    """
+
+    def __init__(self, key, camera, opener):
+        self.key = key
+        self.camera = camera
+        self.opener = opener
+        self.frame = None
+        self.seq = 0
+        self.first_frame_at = None
+        self.alive = True
+        self.close_fn = None
+        self.last_used = time.monotonic()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=f"session-{key}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            read, self.close_fn = self.opener(self.camera)
+            logging.info(f"Session opened for {self.key}")
+            while self.alive:
+                frame = read()
+                if frame is None:
+                    break
+                with self.cond:
+                    self.frame = frame
+                    self.seq += 1
+                    if self.first_frame_at is None:
+                        self.first_frame_at = time.monotonic()
+                    self.cond.notify_all()
+        except Exception as e:
+            logging.warning(f"Session for {self.key} stopped: {e}")
+        finally:
+            self.close()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def rate(self):
+        # frames per second delivered so far, None until it can be told
+        elapsed = time.monotonic() - (self.first_frame_at or time.monotonic())
+        return (self.seq - 1) / elapsed if self.seq > 1 and elapsed > 0 else None
+
+    def latest(self, timeout):
+        # readers reuse their buffers, so the frame is copied while the
+        # reader is kept from publishing over it
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > 0 or not self.alive, timeout=timeout)
+            return None if self.frame is None else self.frame.copy()
+
+    def latest_into(self, out, seq, timeout):
+        """Copies the first frame newer than ``seq`` into ``out`` and returns
+        its sequence number, or None when none came within ``timeout``.
+
+        Jobs sharing the session each sample it at their own pace; a frame
+        is copied straight into the caller's buffer.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > seq or not self.alive, timeout=timeout)
+            if self.frame is None or self.seq <= seq:
+                return None
+            np.copyto(out, self.frame)
+            self.last_used = time.monotonic()
+            return self.seq
+
+    def close(self):
+        with self.cond:
+            self.alive = False
+            self.cond.notify_all()
+        if self.close_fn is not None:
+            try:
+                self.close_fn()
+            except Exception as e:
+                logging.warning(f"Failed to close session for {self.key}: {e}")
+            self.close_fn = None
+
+
+class SessionPool:
+    """Long-lived camera sessions keyed by camera descriptor.
+
+    ``opener(camera)`` must return a ``(read, close)`` pair where ``read``
+    returns the next rgb frame or None at end of stream; it may reuse a
+    ring of at least two buffers. Sessions idle for longer than
+    ``idle_timeout`` seconds are closed, and at most ``max_sessions`` are
+    kept alive (least recently used go first). A pool with
+    ``max_sessions=0`` is disabled.
+    """
+
+    def __init__(self, opener, max_sessions=0, idle_timeout=60):
+        self.opener = opener
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.janitor = None
+
+    @property
+    def enabled(self):
+        return self.max_sessions > 0
+
+    def get(self, camera):
+        key = camera_key(camera)
+        with self.lock:
+            self._start_janitor()
+            session = self.sessions.get(key)
+            if session is None or not session.alive:
+                while len(self.sessions) >= self.max_sessions:
+                    lru = min(self.sessions.values(), key=lambda s: s.last_used)
+                    logging.info(f"Session pool is full. Closing {lru.key}")
+                    self.sessions.pop(lru.key).close()
+                session = CameraSession(key, camera, self.opener)
+                self.sessions[key] = session
+            session.touch()
+            return session
+
+    def peek(self, camera):
+        # the open session a job on camera would reuse, without touching it
+        with self.lock:
+            session = self.sessions.get(camera_key(camera))
+            return session if session is not None and session.alive else None
+
+    def capture(self, camera, timeout=10):
+        session = self.get(camera)
+        frame = session.latest(timeout)
+        if frame is None:
+            logging.warning(f"No frame received from {session.key} in {timeout} seconds")
+            self.discard(session.key)
+        return frame
+
+    def discard(self, key):
+        with self.lock:
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                s for s in self.sessions.values()
+                if not s.alive or now - s.last_used > self.idle_timeout
+            ]
+            for s in expired:
+                self.sessions.pop(s.key)
+        for s in expired:
+            logging.info(f"Closing idle session {s.key}")
+            s.close()
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        for s in sessions:
+            s.close()
+
+    def _start_janitor(self):
+        if self.janitor is not None:
+            return
+
+        def sweep():
+            while True:
+                time.sleep(max(self.idle_timeout / 2, 1))
+                self.evict_idle()
+
+        self.janitor = threading.Thread(target=sweep, name="session-janitor", daemon=True)
+        self.janitor.start()
@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .utils import camera_key
+
+MAGIC = b"FALCOFRM"
+VERSION = 1
+# magic, version, slots, height, width, channels, open flag, latest sequence
+HEADER = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("slots", "<u4"),
+    ("height", "<u4"),
+    ("width", "<u4"),
+    ("channels", "<u4"),
+    ("open", "<u4"),
+    ("latest", "<u8"),
+])
+# per slot: sequence number of the frame in it (0 while it is written) and
+# its unix timestamp
+SLOT = np.dtype([("seq", "<u8"), ("timestamp", "<f8")])
+ALIGN = 64
+
+
+def ring_name(camera):
+    # posix shared memory names are short and flat, camera keys are not
+    return "falcoeye_" + hashlib.sha1(camera_key(camera).encode("utf-8")).hexdigest()[:16]
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _layout(slots, height, width, channels):
+    meta_offset = _aligned(HEADER.itemsize)
+    data_offset = _aligned(meta_offset + SLOT.itemsize * slots)
+    return meta_offset, data_offset, data_offset + slots * height * width * channels
+
+
+class _Ring:
+    def _map(self, slots, height, width, channels):
+        meta_offset, data_offset, _ = _layout(slots, height, width, channels)
+        buf = self.shm.buf
+        self.header = np.ndarray((), dtype=HEADER, buffer=buf)
+        self.meta = np.ndarray((slots,), dtype=SLOT, buffer=buf, offset=meta_offset)
+        self.frames = np.ndarray((slots, height, width, channels), dtype=np.uint8, buffer=buf, offset=data_offset)
+        self.slots = slots
+
+
+class FrameRing(_Ring):
+    """Publishes decoded frames into a shared memory ring.
+
+    Local consumers attach with ``FrameRingReader`` and read frames in
+    place, without any encoding, decoding or disk in between. Each frame
+    is copied once, from the reader buffer into its slot; a slot's sequence
+    number is zeroed while it is being overwritten, so readers can tell a
+    torn frame from a good one.
+    """
+
+    def __init__(self, name, height, width, channels=3, slots=4):
+        _, _, size = _layout(slots, height, width, channels)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left over by a process that died before unlinking it
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+        self._map(slots, height, width, channels)
+        self.meta[:] = 0
+        self.header[()] = (MAGIC, VERSION, slots, height, width, channels, 1, 0)
+        self.seq = 0
+        logging.info(f"Exporting {width}x{height} frames to shared memory {name} ({size} bytes)")
+
+    def publish(self, frame):
+        seq = self.seq + 1
+        slot = seq % self.slots
+        self.meta[slot]["seq"] = 0
+        np.copyto(self.frames[slot], frame)
+        self.meta[slot]["timestamp"] = time.time()
+        self.meta[slot]["seq"] = seq
+        self.header["latest"] = seq
+        self.seq = seq
+
+    def close(self):
+        self.header["open"] = 0
+        del self.header, self.meta, self.frames
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameRingReader(_Ring):
+    """Attaches to a ``FrameRing`` by name, from any local process.
+
+    ``latest`` returns a view into shared memory; a consumer that keeps
+    using it should check ``valid(seq)`` afterwards, as the slot is reused
+    once the ring wraps around. ``read`` returns a checked copy instead.
+    """
+
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13 would unlink the ring when this process exits
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        header = np.ndarray((), dtype=HEADER, buffer=self.shm.buf)
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError(f"{name} is not a frame ring")
+        self._map(int(header["slots"]), int(header["height"]), int(header["width"]), int(header["channels"]))
+
+    @property
+    def open(self):
+        return bool(self.header["open"])
+
+    def latest(self):
+        """Returns ``(seq, timestamp, frame)`` of the newest frame, or None."""
+        seq = int(self.header["latest"])
+        if seq == 0:
+            return None
+        slot = seq % self.slots
+        timestamp = float(self.meta[slot]["timestamp"])
+        if int(self.meta[slot]["seq"]) != seq:
+            # overwritten meanwhile; the next one is newer anyway
+            return self.latest()
+        return seq, timestamp, self.frames[slot]
+
+    def valid(self, seq):
+        return int(self.meta[seq % self.slots]["seq"]) == seq
+
+    def read(self):
+        while True:
+            latest = self.latest()
+            if latest is None:
+                return None
+            seq, timestamp, frame = latest
+            frame = frame.copy()
+            if self.valid(seq):
+                return seq, timestamp, frame
+
+    def close(self):
+        del self.header, self.meta, self.frames
+        self.shm.close()
+
+
+class FrameExporter:
+    """Cameras whose decoded frames are being exported to shared memory.
+
+    ``opener`` is the session opener, ``opener(camera) -> (read, close)``
+    with ``read`` returning rgb frames. Each exported camera gets a thread
+    that keeps reading and publishing until ``unexport``.
+    """
+
+    def __init__(self, opener):
+        self.opener = opener
+        self.exports = {}
+        self.lock = threading.Lock()
+
+    def export(self, camera, slots=4):
+        key = camera_key(camera)
+        name = ring_name(camera)
+        with self.lock:
+            current = self.exports.get(key)
+            if current is not None and current["thread"].is_alive():
+                return name
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=self._run, args=(camera, name, slots, stop), name=f"export-{key}", daemon=True
+            )
+            self.exports[key] = {"thread": thread, "stop": stop}
+            thread.start()
+        return name
+
+    def _run(self, camera, name, slots, stop):
+        ring = None
+        close = None
+        try:
+            read, close = self.opener(camera)
+            while not stop.is_set():
+                frame = read()
+                if frame is None:
+                    logging.warning(f"Stream of {camera_key(camera)} ended. Export {name} stopped")
+                    break
+                if ring is None:
+                    ring = FrameRing(name, frame.shape[0], frame.shape[1], frame.shape[2], slots)
+                ring.publish(frame)
+        except Exception as e:
+            logging.warning(f"Export {name} stopped: {e}")
+        finally:
+            if close is not None:
+                close()
+            if ring is not None:
+                ring.close()
+
+    def unexport(self, camera):
+        with self.lock:
+            export = self.exports.pop(camera_key(camera), None)
+        if export is not None:
+            export["stop"].set()
+            export["thread"].join(timeout=10)
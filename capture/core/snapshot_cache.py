@@ -0,0 +1,93 @@
+import atexit
+import collections
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from .utils import random_string
+
+
+def link_or_copy(f_from, f_to):
+    # a hard link costs no bytes; across filesystems it has to be a copy
+    tmp_path = f"{f_to}.{random_string()}.tmp"
+    try:
+        os.link(f_from, tmp_path)
+    except OSError:
+        shutil.copy2(f_from, tmp_path)
+    os.replace(tmp_path, f_to)
+
+
+class SnapshotCache:
+    """Recent snapshots, kept as jpeg files in ``directory``.
+
+    Entries are keyed by camera and output settings and hold the image and
+    thumbnail files of the last snapshot. A request no older than
+    ``max_age`` seconds is answered by hard-linking (or copying) the cached
+    files to its output paths, without touching the camera. The index is in
+    memory; the least recently used entries are dropped once the files take
+    more than ``max_bytes``.
+
+    As the index is not persisted, entries only outlive the job that made
+    them in a long-running process (service mode); every process keeps its
+    files in a private subdirectory of ``directory``, removed at exit.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="snapshots-", dir=directory)
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        atexit.register(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def serve(self, key, max_age, paths):
+        """Links a fresh entry to ``paths`` (image, thumbnail) and returns
+        whether there was one."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry["time"] > max_age:
+                return False
+            self.entries.move_to_end(key)
+            try:
+                for cached, path in zip(entry["paths"], paths):
+                    link_or_copy(cached, path)
+            except OSError as e:
+                logging.warning(f"Serving cached snapshot failed: {e}")
+                return False
+        logging.info(f"Served snapshot taken {time.time() - entry['time']:.1f}s ago")
+        return True
+
+    def put(self, key, paths):
+        cached_paths = [os.path.join(self.directory, f"{random_string()}.jpg") for _ in paths]
+        try:
+            for path, cached in zip(paths, cached_paths):
+                link_or_copy(path, cached)
+        except OSError as e:
+            logging.warning(f"Caching snapshot failed: {e}")
+            self._remove(cached_paths)
+            return
+        size = sum(os.path.getsize(p) for p in cached_paths)
+        evicted = []
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                evicted.append(old)
+                self.size -= old["size"]
+            self.entries[key] = {"paths": cached_paths, "time": time.time(), "size": size}
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, entry = self.entries.popitem(last=False)
+                evicted.append(entry)
+                self.size -= entry["size"]
+        for entry in evicted:
+            self._remove(entry["paths"])
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,183 @@
+import logging
+import os
+import subprocess as sp
+import time
+
+import numpy as np
+
+from . import metrics
+from .jpeg import write_jpeg
+from .reader import FrameReader
+from .utils import ffmpeg_path, fit_size, mkdir
+
+# This module is imported by the bulk thumbnail pool processes, so it must
+# not build anything at import time (capture.py starts the outbox, sessions
+# and budgets when imported).
+
+# thumbnails fit in a THUMBNAIL_SIZE x THUMBNAIL_SIZE box
+THUMBNAIL_SIZE = 260
+# files a thumbnail directory job picks up
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".avi", ".ts", ".webm")
+# thumbnails are written next to their video with this suffix
+SUFFIX = "_260.jpg"
+
+
+def score(frames):
+    """Sharpness times exposure of every frame of an (n, h, w, 3) stack.
+
+    The sharpness is the mean absolute gradient of the gray image, so
+    black, faded and blurred frames score low; the exposure is 1 at mid
+    gray and 0 for a black or white frame. The whole stack is scored at
+    once, at thumbnail size.
+    """
+    gray = frames.mean(axis=3, dtype=np.float32)
+    sharpness = (
+        np.abs(np.diff(gray, axis=1)).mean(axis=(1, 2))
+        + np.abs(np.diff(gray, axis=2)).mean(axis=(1, 2))
+    )
+    exposure = 1 - np.abs(gray.mean(axis=(1, 2)) - 128) / 128
+    return sharpness * exposure
+
+
+def best(frames):
+    return frames[int(np.argmax(score(frames)))]
+
+
+def video_files(directory=None, videos=None):
+    """The videos of a job: the ``videos`` list, then every video file
+    under ``directory``, sorted."""
+    files = list(videos or [])
+    if directory is not None:
+        for root, _, names in os.walk(directory):
+            files.extend(
+                os.path.join(root, name) for name in sorted(names)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+    return files
+
+
+def thumbnail_path(video_file, directory=None, output_dir=None):
+    # mirrors the layout under directory when thumbnails go elsewhere
+    name = f"{os.path.splitext(video_file)[0]}{SUFFIX}"
+    if output_dir is None:
+        return name
+    if directory is not None and os.path.abspath(video_file).startswith(os.path.abspath(directory) + os.sep):
+        return os.path.join(output_dir, os.path.relpath(name, directory))
+    return os.path.join(output_dir, os.path.basename(name))
+
+
+def probe(url):
+    import ffmpeg
+
+    with metrics.span("probe"):
+        p = ffmpeg.probe(url, select_streams="v")
+    return p["streams"][0]
+
+
+def generate_thumbnail(url, seek=1):
+    # seeking before the input jumps to a keyframe instead of decoding from
+    # the start (and skips fade-ins); the decoder scales straight to size
+    p = probe(url)
+    width, height = fit_size(p["width"], p["height"], THUMBNAIL_SIZE)
+    duration = float(p.get("duration", 0) or 0)
+    seek = min(seek, duration / 2)
+    pipe = sp.Popen(
+        [
+            ffmpeg_path(),
+            "-loglevel",
+            "quiet",
+            "-ss",
+            str(seek),
+            "-i",
+            url,
+            "-an",
+            "-frames:v",
+            "1",
+            "-vf",
+            f"scale={width}:{height}",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-",
+        ],
+        stdin=sp.DEVNULL,
+        stdout=sp.PIPE,
+    )
+    frame = FrameReader(pipe.stdout, width, height, buffer_size=1).read()
+    pipe.wait()
+    return frame
+
+
+def thumbnail_candidates(url, count=5):
+    """Up to ``count`` keyframes spread over a video, at thumbnail size.
+
+    Only keyframes are decoded and the decoder scales them, so each
+    candidate costs about one frame. The first and last tenth of the video
+    (fades, black frames) are left out.
+    """
+    p = probe(url)
+    width, height = fit_size(p["width"], p["height"], THUMBNAIL_SIZE)
+    duration = float(p.get("duration", 0) or 0)
+    # without a duration, the first keyframes have to do
+    vf = f"fps={count / (duration * 0.8)},scale={width}:{height}" if duration else f"scale={width}:{height}"
+    pipe = sp.Popen(
+        [
+            ffmpeg_path(),
+            "-loglevel",
+            "quiet",
+            "-ss",
+            str(duration * 0.1),
+            "-skip_frame",
+            "nokey",
+            "-i",
+            url,
+            "-an",
+            "-vf",
+            vf,
+            "-frames:v",
+            str(count),
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-",
+        ],
+        stdin=sp.DEVNULL,
+        stdout=sp.PIPE,
+    )
+    data = pipe.stdout.read()
+    pipe.wait()
+    n = len(data) // (width * height * 3)
+    return np.frombuffer(data, dtype=np.uint8, count=n * width * height * 3).reshape(n, height, width, 3)
+
+
+def best_thumbnail(url, candidates=1):
+    # the best scored of a few keyframes, or the frame a second in
+    if candidates > 1:
+        frames = thumbnail_candidates(url, candidates)
+        if len(frames):
+            return best(frames)
+    return generate_thumbnail(url)
+
+
+def thumbnail_file(video_file, output_path, candidates=5, overwrite=False, jpeg_options=None):
+    # runs in a pool process, so it reports failures instead of raising them
+    result = {"video": video_file, "thumbnail": output_path}
+    if not overwrite and os.path.exists(output_path):
+        result["status"] = "SKIPPED"
+        return result
+    start = time.perf_counter()
+    try:
+        thumbnail = best_thumbnail(video_file, candidates)
+        if thumbnail is None:
+            raise ValueError("no frame decoded")
+        mkdir(os.path.dirname(output_path))
+        write_jpeg(thumbnail, output_path, **(jpeg_options or {}))
+        result["status"] = "SUCCEEDED"
+    except Exception as e:
+        logging.warning(f"Thumbnail of {video_file} failed: {e}")
+        result["status"] = "FAILED"
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
@@ -5,7 +5,9 @@ import random
 import logging
 from datetime import datetime
 import shutil
-from ..k8s import FalcoServingKube
+import threading
+import time
+from . import metrics
 
 
 TYPE_MAP = {"int": int, "str": str, "float": float, "list": list}
@@ -62,6 +64,18 @@ def put(f_from, f_to):
 	logging.info(f"Local put: copying from {f_from} to {f_to}")
 	shutil.copy2(f_from, f_to)
 
+def move(f_from, f_to):
+	# a rename when both are on the same filesystem, a copy otherwise
+	logging.info(f"Local move: moving from {f_from} to {f_to}")
+	with metrics.span("move"):
+		try:
+			os.replace(f_from, f_to)
+		except OSError:
+			shutil.copy2(f_from, f_to)
+			os.remove(f_from)
+	# recordings and segments end up here; jpegs are counted as they are encoded
+	metrics.count("bytes_written", os.path.getsize(f_to))
+
 def rmtree(path):
 	path = os.path.relpath(path)
 	if not path.endswith("/"):
@@ -73,6 +87,12 @@ def random_string(N=6):
 	logging.info(f"random_string called with N={N}: returning {randomstr}")
 	return randomstr
 
+def ffmpeg_path():
+	ffmpeg = "/usr/local/bin/ffmpeg"
+	if not os.path.exists(ffmpeg):
+		ffmpeg = "/usr/bin/ffmpeg"
+	return ffmpeg
+
 def tempdir():
 	import platform
 	import tempfile
@@ -94,10 +114,78 @@ def rm_file(filename):
 	# must be refactored
 	os.remove(filename)
 		
+class TTLCache:
+	"""Thread safe dict whose entries expire ``ttl`` seconds after being set."""
+
+	def __init__(self, ttl):
+		self.ttl = ttl
+		self.items = {}
+		self.lock = threading.Lock()
+
+	def get(self, key, default=None):
+		with self.lock:
+			item = self.items.get(key)
+			if item is None:
+				return default
+			value, expires = item
+			if time.monotonic() > expires:
+				del self.items[key]
+				return default
+			return value
+
+	def set(self, key, value):
+		with self.lock:
+			self.items[key] = (value, time.monotonic() + self.ttl)
+
+	def pop(self, key):
+		with self.lock:
+			item = self.items.pop(key, None)
+		return None if item is None else item[0]
+
+	def evict(self, predicate):
+		with self.lock:
+			for key in [k for k in self.items if predicate(k)]:
+				del self.items[key]
+
+_services = TTLCache(float(os.getenv("SERVICE_CACHE_TTL", 300)))
+
 def get_service(service_name):
+	# e.g. FALCOEYE_BACKEND_URL=http://localhost:5000 skips kubernetes entirely
+	override = os.getenv(f"{service_name.upper().replace('-', '_')}_URL")
+	if override:
+		return override
+
+	URL = _services.get(service_name)
+	if URL is not None:
+		return URL
+
 	deployment = os.getenv("DEPLOYMENT","local")
 
-	kube = FalcoServingKube(service_name)
-	URL = f"http://" + kube.get_service_address(external=deployment=="local", 
-		hostname=deployment=="local")
-	return URL
\ No newline at end of file
+	with metrics.span("discovery"):
+		# the kubernetes client is slow to import and only needed here
+		from ..k8s import FalcoServingKube
+
+		kube = FalcoServingKube(service_name)
+		address = kube.get_service_address(external=deployment=="local", 
+			hostname=deployment=="local")
+	if address is None:
+		raise ValueError(f"No address found for service {service_name}")
+	URL = f"http://{address}"
+	_services.set(service_name, URL)
+	return URL
+
+def forget_service(service_name):
+	_services.pop(service_name)
+
+def camera_key(camera):
+	if "url" in camera:
+		return camera["url"]
+	return f'{camera["username"]}@{camera["host"]}:{camera["port"]}'
+
+def fit_size(width, height, box=None):
+	# largest size with the same aspect ratio that fits in a box x box square,
+	# never upscaled
+	if not box or max(width, height) <= box:
+		return width, height
+	scale = box / max(width, height)
+	return max(1, round(width * scale)), max(1, round(height * scale))
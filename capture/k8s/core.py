@@ -4,10 +4,25 @@ import os
 
 import yaml
 from kubernetes import client, config, utils
+from kubernetes.client.rest import ApiException
 import kubernetes
 
 logger = logging.getLogger(__name__)
 
+_config_loaded = False
+
+
+def load_config():
+    # kube config only needs to be read once per process
+    global _config_loaded
+    if _config_loaded:
+        return
+    try:
+        config.load_kube_config()
+    except:
+        config.load_incluster_config()
+    _config_loaded = True
+
 
 class FalcoServingKube:
     ARTIFACT_REGISTRY = None
@@ -20,27 +35,31 @@ class FalcoServingKube:
         self.service_name = self.name+"-svc"
         self.base_name = name.split("/")[-1]
         self.namespace = namespace
+        load_config()
+
+    def read_deployment(self):
+        v1 = client.AppsV1Api()
         try:
-            config.load_kube_config()
-        except:
-            config.load_incluster_config()
+            return v1.read_namespaced_deployment(namespace=self.namespace, name=self.name)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
 
+    def read_service(self):
+        v1 = client.CoreV1Api()
+        try:
+            return v1.read_namespaced_service(namespace=self.namespace, name=self.name)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
 
     def deployment_exists(self):
-        v1 = client.AppsV1Api()
-        resp = v1.list_namespaced_deployment(namespace=self.namespace)
-        for i in resp.items:
-            if i.metadata.name == self.name:
-                return True
-        return False
+        return self.read_deployment() is not None
 
     def service_exists(self):
-        v1 = client.CoreV1Api()
-        resp = v1.list_namespaced_service(namespace=self.namespace)
-        for i in resp.items:
-            if i.metadata.name == self.name:
-                return True
-        return False
+        return self.read_service() is not None
 
     def is_running(self):
         if self.deployment_exists() and self.service_exists():
@@ -48,20 +67,20 @@ class FalcoServingKube:
         return False
 
     def get_service_address(self, external=False, hostname=False):
-        if not self.is_running():
+        service = self.read_service()
+        if service is None or not self.deployment_exists():
             logger.error(f"No running deployment found for {self.name}.")
             return None
 
         v1 = client.CoreV1Api()
-        service = v1.read_namespaced_service(namespace=self.namespace, name=self.name)
         [port] = [port.port for port in service.spec.ports]
         
         if external:
             try:
                 service = v1.read_namespaced_service(namespace=self.namespace, name=self.service_name)
             except Exception :
-                # trying without -svc
-                service = v1.read_namespaced_service(namespace=self.namespace, name=self.service_name[:-4])
+                # without -svc it is the service already read above
+                pass
             if hostname:
                 host = service.status.load_balancer.ingress[0].hostname
             else:
@@ -1,6 +1,5 @@
 import os
-import requests
-import logging 
+import logging
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s",
@@ -9,28 +8,45 @@ logging.basicConfig(
 import json
 from capture.core.utils import get_service
 from capture.core.capture import CaptureRunner
+from capture.core import backend, metrics
+from capture.core.postback import get_outbox
 
-URL = get_service("falcoeye-backend")
 
-streaming_user = os.getenv("STREAMING_USER")
-streaming_password = os.getenv("STREAMING_PASSWORD")
+def main():
+    URL = get_service("falcoeye-backend")
 
-payload =  {
-        "email": streaming_user.strip(),
-        "password": streaming_password.strip()
-}
-logging.info(f"Logging in {URL}")
-r = requests.post(f"{URL}/auth/login", json=payload)
+    streaming_user = os.getenv("STREAMING_USER")
+    streaming_password = os.getenv("STREAMING_PASSWORD")
 
-assert "access_token" in r.json()
-access_token = r.json()["access_token"]
-os.environ["JWT_KEY"] = f'JWT {access_token}'
+    backend.login(URL, streaming_user, streaming_password)
 
+    if os.getenv("CAPTURE_MODE", "job") == "service":
+        from capture.core.service import CaptureService
 
-capture_file = os.getenv("CAPTURE_PATH")
-with open(capture_file) as f:
-    data = json.load(f)
+        # resends the status updates an earlier process left undelivered
+        get_outbox()
 
-CaptureRunner.run_from_dict(data)
-logging.info(f"Capture completed")
+        service = CaptureService(
+            workers=int(os.getenv("CAPTURE_WORKERS", 0)) or None,
+            per_camera=int(os.getenv("CAPTURE_PER_CAMERA", 1)),
+        )
+        service.serve(
+            # jobs pick the paths they write to, so only local callers by default
+            host=os.getenv("CAPTURE_HOST", "127.0.0.1"),
+            port=int(os.getenv("CAPTURE_PORT", 8000)),
+            spool_dir=os.getenv("CAPTURE_SPOOL_DIR"),
+        )
+    else:
+        capture_file = os.getenv("CAPTURE_PATH")
+        with open(capture_file) as f:
+            data = json.load(f)
 
+        CaptureRunner.run_from_dict(data)
+        logging.info(f"Capture completed")
+        get_outbox().flush()
+        logging.info(f"Start-up and post-backs took {metrics.process.summary()['spans']}")
+
+
+# the bulk thumbnail pool spawns processes that import this module again
+if __name__ == "__main__":
+    main()
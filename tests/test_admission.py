@@ -0,0 +1,107 @@
+import threading
+import time
+
+from capture.core.admission import Budget, Cost, estimate, fps_within
+
+
+class FixedDiskBudget(Budget):
+    # a scratch disk with a known amount free
+    def __init__(self, *args, free=2**40, **kwargs):
+        super().__init__(*args, scratch_dir=".", **kwargs)
+        self.free = free
+
+    def free_disk(self):
+        return self.free
+
+
+def budget(memory=1000, disk=1000, cpu=4, **kwargs):
+    return FixedDiskBudget(memory=memory, disk=disk, cpu=cpu, **kwargs)
+
+
+def test_acquire_and_release_account_for_every_resource():
+    b = budget()
+    assert b.acquire(Cost(memory=400, disk=100, cpu=1), timeout=0)
+    assert b.acquire(Cost(memory=600, disk=200, cpu=2), timeout=0)
+    assert (b.used.memory, b.used.disk, b.used.cpu) == (1000, 300, 3)
+    b.release(Cost(memory=400, disk=100, cpu=1))
+    assert (b.used.memory, b.used.disk, b.used.cpu) == (600, 200, 2)
+
+
+def test_acquire_times_out_when_running_jobs_hold_the_budget():
+    b = budget()
+    assert b.acquire(Cost(memory=800), timeout=0)
+    start = time.monotonic()
+    assert not b.acquire(Cost(memory=300), timeout=0.2)
+    assert time.monotonic() - start >= 0.2
+    assert b.used.memory == 800
+
+
+def test_release_wakes_a_waiting_job():
+    b = budget()
+    held = Cost(memory=800)
+    assert b.acquire(held, timeout=0)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(b.acquire(Cost(memory=300), timeout=5)))
+    waiter.start()
+    time.sleep(0.1)
+    assert results == []
+    start = time.monotonic()
+    b.release(held)
+    waiter.join(5)
+    assert results == [True]
+    assert time.monotonic() - start < 1
+    assert b.used.memory == 300
+
+
+def test_one_job_always_runs_however_much_cpu_it_needs():
+    b = budget(cpu=2)
+    big = Cost(cpu=3)
+    assert b.acquire(big, timeout=0)
+    assert not b.acquire(Cost(cpu=0.5), timeout=0)
+    b.release(big)
+    assert b.acquire(Cost(cpu=1.5), timeout=0)
+    assert b.acquire(Cost(cpu=0.5), timeout=0)
+    assert not b.acquire(Cost(cpu=0.1), timeout=0)
+
+
+def test_one_job_runs_after_float_costs_are_released():
+    b = budget(memory=2**32, disk=2**32, cpu=4)
+    costs = [
+        estimate("video", 1920, 1080, fps=30, length=10),
+        estimate("timelapse", 1280, 720, samples=10),
+    ]
+    for cost in costs:
+        assert b.acquire(cost, timeout=0)
+    for cost in costs:
+        b.release(cost)
+    assert b.used.cpu != 0
+    # however little cpu the sums leave over, an idle budget runs a big job
+    timelapse = estimate("timelapse", 3840, 2160, samples=100)
+    assert timelapse.cpu > b.cpu
+    assert b.acquire(timelapse, timeout=0)
+
+
+def test_disk_is_checked_against_what_is_free():
+    b = budget(disk=1000, free=150)
+    assert not b.acquire(Cost(disk=200), timeout=0)
+    assert b.acquire(Cost(disk=100), timeout=0)
+    assert b.fits(Cost(disk=1000))
+    assert not b.fits(Cost(disk=1001))
+
+
+def test_decoding_is_priced_at_the_source_rate():
+    full = estimate("video", 1920, 1080, fps=30, length=60)
+    decimated = estimate("video", 1920, 1080, fps=5, length=60, source_fps=30)
+    shared = estimate("video", 1920, 1080, fps=5, source_fps=30, shared=True)
+    assert shared.cpu < decimated.cpu < full.cpu
+    # the decoder still runs at 30 fps
+    assert decimated.cpu > full.cpu / 2
+    assert decimated.disk < full.disk
+
+
+def test_fps_within_leaves_room_for_the_decoder():
+    fps = fps_within(1.0, 1920, 1080, 30)
+    assert estimate("video", 1920, 1080, fps=fps, source_fps=30).cpu <= 1.0
+    assert estimate("video", 1920, 1080, fps=fps + 1, source_fps=30).cpu > 1.0
+    assert fps_within(0.1, 1920, 1080, 30) == 1
+    assert fps_within(1.0, 1920, 1080, 30, shared=True) > fps
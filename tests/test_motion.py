@@ -0,0 +1,88 @@
+import os
+import time
+
+import numpy as np
+
+from capture.core.motion import MotionFilter, downscale_gray
+
+
+def frame(value=0, size=(120, 160)):
+    return np.full((*size, 3), value, dtype=np.uint8)
+
+
+def test_downscale_gray_is_small_and_channel_order_free():
+    f = np.zeros((480, 640, 3), dtype=np.uint8)
+    f[..., 0] = 90
+    small = downscale_gray(f)
+    assert small.dtype == np.float32
+    assert max(small.shape) <= 2 * 64
+    np.testing.assert_allclose(small, downscale_gray(f[..., ::-1]))
+    np.testing.assert_allclose(small, 30)
+
+
+def test_first_frame_and_large_changes_count_as_changed():
+    motion = MotionFilter()
+    assert motion.changed(frame(0))
+    assert not motion.changed(frame(10))  # under the pixel threshold
+    assert motion.changed(frame(200))
+
+
+def test_small_regions_stay_under_the_change_threshold():
+    motion = MotionFilter(threshold=0.05)
+    motion.changed(frame(0))
+    f = frame(0)
+    f[:2, :2] = 255
+    assert not motion.changed(f)
+    f[:60] = 255
+    assert motion.changed(f)
+
+
+def test_slow_drift_adds_up_against_the_last_changed_frame():
+    motion = MotionFilter()
+    motion.changed(frame(0))
+    changes = [motion.changed(frame(v)) for v in (10, 20, 30)]
+    # each step is under the pixel threshold, but 30 is not from 0
+    assert changes == [False, False, True]
+
+
+def test_mark_keeps_every_frame_and_reports_idle_stretches():
+    motion = MotionFilter(min_idle=1.0)
+    kept = [motion.observe(frame(0), t * 0.5) for t in range(6)]
+    motion.observe(frame(200), 3.0)
+    motion.observe(frame(200), 3.5)
+    motion.close(3.6)
+    assert all(kept)
+    # a stretch of 0.1s is too short to count
+    assert motion.idle == [[0.5, 3.0]]
+
+
+def test_drop_keeps_only_the_start_of_an_idle_stretch():
+    motion = MotionFilter(min_idle=1.0, drop=True)
+    kept = [motion.observe(frame(0), t * 0.5) for t in range(6)]
+    assert kept == [True, True, True, False, False, False]
+    assert motion.observe(frame(200), 3.0)
+
+
+def test_a_saved_reference_carries_over_to_a_new_filter(tmp_path):
+    path = str(tmp_path / "reference.npy")
+    motion = MotionFilter()
+    motion.changed(frame(0))
+    motion.save(path)
+    fresh = MotionFilter()
+    assert fresh.load(path, max_age=60)
+    assert not fresh.changed(frame(10))
+    assert fresh.changed(frame(200))
+
+
+def test_old_missing_and_broken_references_are_ignored(tmp_path):
+    path = tmp_path / "reference.npy"
+    assert not MotionFilter().load(str(path), max_age=60)
+    motion = MotionFilter()
+    motion.changed(frame(0))
+    motion.save(str(path))
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    assert not MotionFilter().load(str(path), max_age=60)
+    path.write_bytes(b"not an array")
+    fresh = MotionFilter()
+    assert not fresh.load(str(path), max_age=60)
+    assert fresh.changed(frame(0))
@@ -0,0 +1,93 @@
+import json
+import threading
+
+from capture.core.postback import Outbox
+
+
+class RecordingOutbox(Outbox):
+    """Records deliveries instead of calling the backend."""
+
+    def __init__(self, results=(), gate=None, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        self.results = list(results)
+        self.gate = gate
+        self.sent = []
+        self.started = threading.Event()
+        super().__init__(**kwargs)
+
+    def send(self, registry_key, payload):
+        self.sent.append((registry_key, payload["capture_status"]))
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return self.results.pop(0) if self.results else True
+
+
+def test_a_newer_status_replaces_an_undelivered_one():
+    gate = threading.Event()
+    outbox = RecordingOutbox(gate=gate)
+    outbox.post("k", {"capture_status": "RUNNING"})
+    assert outbox.started.wait(5)
+    # the first one is being sent; the next two wait, and only the last counts
+    outbox.post("k", {"capture_status": "RUNNING"})
+    outbox.post("k", {"capture_status": "SUCCEEDED"})
+    gate.set()
+    assert outbox.flush(5)
+    assert outbox.sent == [("k", "RUNNING"), ("k", "SUCCEEDED")]
+
+
+def test_a_newer_status_stays_spooled_while_an_older_one_is_delivered(tmp_path):
+    spooled = []
+
+    class SpoolCheckingOutbox(RecordingOutbox):
+        def send(self, registry_key, payload):
+            # what the spool holds once every earlier delivery was processed
+            path = tmp_path / "k.json"
+            spooled.append(json.loads(path.read_text())["payload"]["capture_status"] if path.exists() else None)
+            return super().send(registry_key, payload)
+
+    gate = threading.Event()
+    outbox = SpoolCheckingOutbox(gate=gate, spool_dir=str(tmp_path))
+    outbox.post("k", {"capture_status": "RUNNING"})
+    assert outbox.started.wait(5)
+    outbox.post("k", {"capture_status": "SUCCEEDED"})
+    gate.set()
+    assert outbox.flush(5)
+    assert outbox.sent == [("k", "RUNNING"), ("k", "SUCCEEDED")]
+    # delivering RUNNING did not forget the file holding SUCCEEDED
+    assert spooled == ["RUNNING", "SUCCEEDED"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_deliveries_are_retried():
+    outbox = RecordingOutbox(results=[False, False, True])
+    outbox.post("k", {"capture_status": "SUCCEEDED"})
+    assert outbox.flush(5)
+    assert outbox.sent == [("k", "SUCCEEDED")] * 3
+
+
+def test_gives_up_after_the_last_retry(tmp_path):
+    outbox = RecordingOutbox(results=[False] * 10, retries=3, spool_dir=str(tmp_path))
+    outbox.post("k", {"capture_status": "SUCCEEDED"})
+    assert outbox.flush(5)
+    assert len(outbox.sent) == 3
+    # left on disk for the next process
+    assert (tmp_path / "k.json").exists()
+
+
+def test_delivered_updates_leave_the_spool(tmp_path):
+    outbox = RecordingOutbox(spool_dir=str(tmp_path))
+    outbox.post("a/b", {"capture_status": "SUCCEEDED"})
+    assert outbox.flush(5)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spooled_updates_are_resent_by_the_next_process(tmp_path):
+    (tmp_path / "k.json").write_text(
+        json.dumps({"registry_key": "k", "payload": {"capture_status": "FAILED"}})
+    )
+    (tmp_path / "broken.json").write_text("{")
+    outbox = RecordingOutbox(spool_dir=str(tmp_path))
+    assert outbox.flush(5)
+    assert outbox.sent == [("k", "FAILED")]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,95 @@
+import collections
+import threading
+
+import pytest
+
+from capture.core.preroll import TS_PACKET, PrerollBuffer, random_access_points
+
+PAT, SDT, PMT, VIDEO = 0x0000, 0x0011, 0x1000, 0x0100
+
+
+def packet(pid, keyframe=False, tag=0):
+    data = bytearray(TS_PACKET)
+    data[0] = 0x47
+    data[1] = (pid >> 8) & 0x1F
+    data[2] = pid & 0xFF
+    if keyframe:
+        # adaptation field with the random access indicator set
+        data[3] = 0x30
+        data[4] = 7
+        data[5] = 0x40
+    else:
+        data[3] = 0x10
+    data[-1] = tag
+    return bytes(data)
+
+
+def gop(tag, frames=3, tables=(PAT, SDT, PMT)):
+    return b"".join(
+        [packet(pid, tag=tag) for pid in tables]
+        + [packet(VIDEO, keyframe=True, tag=tag)]
+        + [packet(VIDEO, tag=tag) for _ in range(frames - 1)]
+    )
+
+
+def buffer(seconds=60):
+    # a PrerollBuffer without its ffmpeg pipe, fed through _append
+    b = PrerollBuffer.__new__(PrerollBuffer)
+    b.seconds = seconds
+    b.gops = collections.deque()
+    b.lead = bytearray()
+    b.listeners = []
+    b.lock = threading.Lock()
+    return b
+
+
+def feed(b, data, cuts=(), now=0):
+    # cuts are packet indices at which the stream is split into chunks
+    bounds = [0, *(c * TS_PACKET for c in cuts), len(data)]
+    for start, end in zip(bounds, bounds[1:]):
+        if end > start:
+            b._append(data[start:end], now)
+
+
+def test_random_access_points():
+    chunk = packet(PAT) + packet(VIDEO, keyframe=True) + packet(VIDEO) + packet(VIDEO, keyframe=True)
+    assert list(random_access_points(chunk)) == [1, 3]
+
+
+def test_gops_start_with_the_tables_before_their_keyframe():
+    gops = [gop(1), gop(2, frames=4), gop(3, tables=(PAT, PMT))]
+    b = buffer()
+    feed(b, b"".join(gops))
+    assert [bytes(g) for _, g in b.gops] == gops
+
+
+def test_packets_before_the_first_keyframe_are_dropped():
+    b = buffer()
+    feed(b, packet(VIDEO, tag=9) * 2 + gop(1) + gop(2))
+    assert [bytes(g) for _, g in b.gops] == [gop(1), gop(2)]
+
+
+@pytest.mark.parametrize("cut", range(1, 13))
+def test_chunk_boundaries_do_not_change_the_gops(cut):
+    # every cut position, including between the tables and the keyframe
+    # they belong to, and inside the run of tables
+    gops = [gop(1), gop(2), gop(3)]
+    b = buffer()
+    feed(b, b"".join(gops), cuts=(cut,))
+    assert [bytes(g) for _, g in b.gops] == gops
+
+
+def test_tables_split_over_several_chunks():
+    gops = [gop(1), gop(2)]
+    b = buffer()
+    # one packet per chunk
+    feed(b, b"".join(gops), cuts=range(1, 12))
+    assert [bytes(g) for _, g in b.gops] == gops
+
+
+def test_old_gops_are_trimmed_once_the_next_covers_the_window():
+    b = buffer(seconds=10)
+    for t, tag in enumerate((1, 2, 3, 4)):
+        feed(b, gop(tag), now=t * 6)
+    # at 18s the window starts at 8s, which the gop from 6s covers
+    assert [bytes(g) for _, g in b.gops] == [gop(2), gop(3), gop(4)]
@@ -0,0 +1,69 @@
+import io
+
+import numpy as np
+
+from capture.core.reader import FrameReader
+
+
+class ChunkedStream(io.RawIOBase):
+    """A pipe that hands out at most ``chunk`` bytes per read, like ffmpeg's."""
+
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.chunk = chunk
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.chunk, len(self.data) - self.offset)
+        buffer[:n] = self.data[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+
+def frames(count, height=3, width=4):
+    return np.arange(count * height * width * 3, dtype=np.uint32).astype(np.uint8).reshape(count, height, width, 3)
+
+
+def test_frames_are_assembled_from_short_reads():
+    expected = frames(3)
+    reader = FrameReader(ChunkedStream(expected.tobytes(), chunk=7), 4, 3)
+    for frame in expected:
+        np.testing.assert_array_equal(reader.read().copy(), frame)
+    assert reader.read() is None
+    assert reader.count == 3
+
+
+def test_a_trailing_partial_frame_is_dropped():
+    expected = frames(2)
+    data = expected.tobytes()[:-5]
+    reader = FrameReader(ChunkedStream(data, chunk=1000), 4, 3)
+    np.testing.assert_array_equal(reader.read(), expected[0])
+    assert reader.read() is None
+    assert reader.count == 1
+
+
+def test_an_empty_stream_has_no_frame():
+    assert FrameReader(ChunkedStream(b"", chunk=10), 4, 3).read() is None
+
+
+def test_frames_are_views_into_a_reused_ring():
+    expected = frames(3)
+    reader = FrameReader(ChunkedStream(expected.tobytes(), chunk=1000), 4, 3, buffer_size=2)
+    first = reader.read()
+    second = reader.read()
+    np.testing.assert_array_equal(first, expected[0])
+    reader.read()
+    # the ring wrapped around: the first slot now holds the third frame
+    np.testing.assert_array_equal(first, expected[2])
+    np.testing.assert_array_equal(second, expected[1])
+
+
+def test_frames_can_be_read_into_a_given_array():
+    expected = frames(1)
+    out = np.zeros((3, 4, 3), dtype=np.uint8)
+    reader = FrameReader(ChunkedStream(expected.tobytes(), chunk=5), 4, 3)
+    assert reader.read(out) is out
+    np.testing.assert_array_equal(out, expected[0])
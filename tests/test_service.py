@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+from capture.core.service import CaptureRunner, CaptureService
+
+
+def camera(name):
+    return {"url": f"rtsp://{name}/stream"}
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """Jobs block until their release event is set and record their order."""
+    state = {"started": [], "release": {}, "cond": threading.Condition()}
+
+    def run_from_dict(capture_dict):
+        key = capture_dict["registry_key"]
+        with state["cond"]:
+            state["started"].append(key)
+            state["cond"].notify_all()
+        state["release"].setdefault(key, threading.Event()).wait(5)
+        return key
+
+    def release(key):
+        state["release"].setdefault(key, threading.Event()).set()
+
+    def wait_started(*keys):
+        with state["cond"]:
+            return state["cond"].wait_for(lambda: all(k in state["started"] for k in keys), timeout=5)
+
+    monkeypatch.setattr(CaptureRunner, "run_from_dict", staticmethod(run_from_dict))
+    state["release_job"] = release
+    state["wait_started"] = wait_started
+    return state
+
+
+def job(key, name):
+    return {"type": "image", "registry_key": key, "camera": camera(name)}
+
+
+def test_a_busy_camera_does_not_hold_the_workers(jobs):
+    service = CaptureService(workers=2, per_camera=1)
+    futures = {key: service.submit(job(key, "a")) for key in ("a1", "a2", "a3", "a4")}
+    futures["b1"] = service.submit(job("b1", "b"))
+    # a2..a4 wait in camera a's queue, so the second worker runs b1
+    assert jobs["wait_started"]("a1", "b1")
+    assert sorted(jobs["started"]) == ["a1", "b1"]
+    assert len(service.cameras["rtsp://a/stream"]["pending"]) == 3
+    jobs["release_job"]("b1")
+    assert futures["b1"].result(5) == "b1"
+    assert "rtsp://b/stream" not in service.cameras
+    for key in ("a1", "a2", "a3", "a4"):
+        assert jobs["wait_started"](key)
+        jobs["release_job"](key)
+        assert futures[key].result(5) == key
+    # camera a's jobs ran one at a time and in order
+    assert [k for k in jobs["started"] if k.startswith("a")] == ["a1", "a2", "a3", "a4"]
+    assert service.cameras == {}
+
+
+def test_per_camera_jobs_run_together(jobs):
+    service = CaptureService(workers=4, per_camera=2)
+    futures = [service.submit(job(key, "a")) for key in ("a1", "a2", "a3")]
+    assert jobs["wait_started"]("a1", "a2")
+    assert "a3" not in jobs["started"]
+    jobs["release_job"]("a1")
+    assert jobs["wait_started"]("a3")
+    for key in ("a2", "a3"):
+        jobs["release_job"](key)
+    assert [f.result(5) for f in futures] == ["a1", "a2", "a3"]
+
+
+def test_a_failing_job_frees_its_camera(jobs, monkeypatch):
+    def fail(capture_dict):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(CaptureRunner, "run_from_dict", staticmethod(fail))
+    service = CaptureService(workers=1)
+    first = service.submit(job("a1", "a"))
+    second = service.submit(job("a2", "a"))
+    with pytest.raises(RuntimeError):
+        first.result(5)
+    with pytest.raises(RuntimeError):
+        second.result(5)
+    assert service.cameras == {}
+
+
+def test_the_http_endpoint_listens_on_loopback_by_default():
+    server = CaptureService(workers=1).serve_http(port=0)
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+    finally:
+        server.shutdown()
+        server.server_close()
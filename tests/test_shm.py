@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from capture.core.shm import FrameExporter, FrameRing, FrameRingReader, ring_name
+
+
+@pytest.fixture
+def name(request):
+    return f"falcoeye_test_{os.getpid()}_{request.node.name[:20]}"
+
+
+def frame(value, height=4, width=6):
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+
+def test_reader_sees_the_newest_frame(name):
+    ring = FrameRing(name, 4, 6, slots=3)
+    reader = FrameRingReader(name)
+    try:
+        assert reader.open
+        assert reader.latest() is None
+        assert reader.read() is None
+        for value in (1, 2):
+            ring.publish(frame(value))
+        seq, timestamp, view = reader.latest()
+        assert seq == 2
+        assert abs(timestamp - time.time()) < 5
+        np.testing.assert_array_equal(view, frame(2))
+        assert reader.valid(2)
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_wrapping_around_invalidates_older_views(name):
+    ring = FrameRing(name, 4, 6, slots=3)
+    reader = FrameRingReader(name)
+    try:
+        ring.publish(frame(1))
+        seq, _, view = reader.latest()
+        copy = reader.read()
+        for value in (2, 3, 4):
+            ring.publish(frame(value))
+        # the view now shows another frame, and says so
+        assert not reader.valid(seq)
+        np.testing.assert_array_equal(view, frame(4))
+        # the copy read before is untouched
+        assert copy[0] == 1
+        np.testing.assert_array_equal(copy[2], frame(1))
+        seq, _, latest = reader.read()
+        assert seq == 4
+        np.testing.assert_array_equal(latest, frame(4))
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_a_slot_being_written_is_not_valid(name):
+    ring = FrameRing(name, 4, 6, slots=3)
+    reader = FrameRingReader(name)
+    try:
+        ring.publish(frame(1))
+        ring.meta[1]["seq"] = 0
+        assert not reader.valid(1)
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_readers_see_the_ring_close(name):
+    ring = FrameRing(name, 4, 6)
+    reader = FrameRingReader(name)
+    ring.publish(frame(1))
+    ring.close()
+    assert not reader.open
+    reader.close()
+    with pytest.raises(FileNotFoundError):
+        FrameRingReader(name)
+
+
+def test_a_stale_ring_is_replaced(name):
+    stale = shared_memory.SharedMemory(name=name, create=True, size=16)
+    try:
+        ring = FrameRing(name, 4, 6)
+        reader = FrameRingReader(name)
+        assert reader.latest() is None
+        reader.close()
+        ring.close()
+    finally:
+        stale.close()
+
+
+def test_other_shared_memory_is_not_read_as_a_ring(name):
+    other = shared_memory.SharedMemory(name=name, create=True, size=4096)
+    try:
+        with pytest.raises(ValueError):
+            FrameRingReader(name)
+    finally:
+        other.close()
+        other.unlink()
+
+
+def test_exporter_publishes_until_unexported():
+    camera = {"type": "rtsp", "host": "test", "port": os.getpid(), "username": "", "password": ""}
+    closed = threading.Event()
+
+    def opener(_):
+        count = iter(range(1, 10**6))
+
+        def read():
+            time.sleep(0.005)
+            return frame(next(count) % 256)
+
+        return read, closed.set
+
+    exporter = FrameExporter(opener)
+    name = exporter.export(camera, slots=3)
+    assert name == ring_name(camera)
+    assert exporter.export(camera) == name
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            reader = FrameRingReader(name)
+            break
+        except FileNotFoundError:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    try:
+        first = reader.read()
+        time.sleep(0.05)
+        assert reader.read()[0] > first[0]
+        exporter.unexport(camera)
+        assert closed.is_set()
+        assert not reader.open
+    finally:
+        reader.close()
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from capture.core import snapshot_cache
+from capture.core.snapshot_cache import SnapshotCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SnapshotCache(str(tmp_path / "cache"), max_bytes=250)
+
+
+def snapshot(directory, name, size=100):
+    paths = [str(directory / f"{name}.jpg"), str(directory / f"{name}_260.jpg")]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(name.encode("utf-8").ljust(size // 2, b"."))
+    return paths
+
+
+def outputs(directory, name):
+    return [str(directory / f"{name}.jpg"), str(directory / f"{name}_260.jpg")]
+
+
+def test_a_fresh_entry_is_served_to_new_paths(cache, tmp_path):
+    cache.put("a", snapshot(tmp_path, "a"))
+    served = outputs(tmp_path, "served")
+    assert cache.serve("a", max_age=60, paths=served)
+    with open(served[0], "rb") as f:
+        assert f.read().startswith(b"a.")
+
+
+def test_stale_and_unknown_entries_are_not_served(cache, tmp_path):
+    cache.put("a", snapshot(tmp_path, "a"))
+    cache.entries["a"]["time"] = time.time() - 30
+    assert not cache.serve("a", max_age=10, paths=outputs(tmp_path, "served"))
+    assert not cache.serve("b", max_age=60, paths=outputs(tmp_path, "served"))
+    assert not os.path.exists(outputs(tmp_path, "served")[0])
+    assert cache.serve("a", max_age=60, paths=outputs(tmp_path, "served"))
+
+
+def test_least_recently_used_entries_go_once_over_the_byte_limit(cache, tmp_path):
+    cache.put("a", snapshot(tmp_path, "a"))
+    cache.put("b", snapshot(tmp_path, "b"))
+    # a was used last, so b goes to make room for c
+    assert cache.serve("a", max_age=60, paths=outputs(tmp_path, "served"))
+    cache.put("c", snapshot(tmp_path, "c"))
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.size == 200
+    assert len(os.listdir(cache.directory)) == 4
+
+
+def test_a_newer_snapshot_replaces_the_entry(cache, tmp_path):
+    cache.put("a", snapshot(tmp_path, "a"))
+    cache.put("a", snapshot(tmp_path, "b"))
+    assert cache.size == 100
+    assert len(os.listdir(cache.directory)) == 2
+    served = outputs(tmp_path, "served")
+    assert cache.serve("a", max_age=60, paths=served)
+    with open(served[0], "rb") as f:
+        assert f.read().startswith(b"b.")
+
+
+def test_files_are_linked_when_possible(cache, tmp_path):
+    paths = snapshot(tmp_path, "a")
+    cache.put("a", paths)
+    assert os.stat(paths[0]).st_nlink == 2
+    served = outputs(tmp_path, "served")
+    cache.serve("a", max_age=60, paths=served)
+    assert os.path.samefile(paths[0], served[0])
+
+
+def test_files_are_copied_across_filesystems(cache, tmp_path, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(snapshot_cache.os, "link", cross_device)
+    paths = snapshot(tmp_path, "a")
+    cache.put("a", paths)
+    assert os.stat(paths[0]).st_nlink == 1
+    served = outputs(tmp_path, "served")
+    assert cache.serve("a", max_age=60, paths=served)
+    assert not os.path.samefile(paths[0], served[0])
+    with open(served[1], "rb") as f:
+        assert f.read().startswith(b"a.")
+
+
+def test_the_cache_keeps_to_a_private_subdirectory(tmp_path):
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / "keep.txt").write_text("not ours")
+    cache = SnapshotCache(str(tmp_path / "cache"))
+    assert os.path.dirname(cache.directory) == str(tmp_path / "cache")
+    assert (tmp_path / "cache" / "keep.txt").exists()